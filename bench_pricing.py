@@ -0,0 +1,55 @@
+'''Micro-benchmark of cart pricing for 100-line carts.
+Run: python3 bench_pricing.py'''
+
+import random, timeit
+
+from catalog import Catalog
+from models import Cart, CartLine
+from pricing import PricingEngine, price_cart
+
+LINES = 100
+ITEMS = 500
+NUMBER = 1000
+
+
+def build_catalog() -> Catalog:
+    menu_items = {}
+    for menu_item_id in range(1, ITEMS + 1):
+        menu_items[menu_item_id] = {'data': {'attributes': {
+            'menu_name': f"Item {menu_item_id}",
+            'menu_price': round(random.uniform(10, 200), 2),
+            'currency': 'VND',
+        }}}
+    return Catalog(1, menu_items=menu_items)
+
+
+def build_cart() -> Cart:
+    cart = Cart()
+    for uid in range(LINES):
+        options = [{'name': 'Extra', 'price': 5.0, 'currency': 'VND'}] if uid % 3 == 0 else []
+        cart.add(CartLine(f"{uid:08d}", random.randint(1, ITEMS), random.randint(1, 5), options))
+    return cart
+
+
+def run() -> None:
+    random.seed(1)
+    catalog = build_catalog()
+    cart = build_cart()
+    config = {'tmp-delivery-fee': 20000, 'tmp-delivery-free-limit': 300000}
+    coupon = {'attributes': {'code': 'SALE', 'type': 'P', 'discount': 10}}
+    engine = PricingEngine(config)
+
+    results = {
+        'price_cart (no cache)': lambda: price_cart(cart, catalog, 'delivery', coupon, 20000, 300000),
+        'engine.quote (cached)': lambda: engine.quote(cart, catalog, 'delivery', coupon),
+        'engine.quote (cart changed)': lambda: (cart.set_quantity("00000000", random.randint(1, 5)), engine.quote(cart, catalog, 'delivery', coupon)),
+    }
+    print(f"{LINES}-line cart, {NUMBER} runs")
+    for name, function in results.items():
+        seconds = timeit.timeit(function, number=NUMBER)
+        print(f"{name:30} {seconds / NUMBER * 1e6:10.1f} us per quote")
+    print(f"Cache: {engine.stats}")
+
+
+if __name__ == "__main__":
+    run()
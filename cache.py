@@ -0,0 +1,202 @@
+import logging, json, os, time, hashlib, tempfile, threading
+from collections import OrderedDict
+
+# Temporary files older than this are left by a crashed process. Newer ones may be written by another worker right now
+STALE_TEMP_SECONDS = 600
+
+
+class ResponseCache:
+    '''Cache of Tastyigniter API responses.
+    Recently used responses are kept in memory in front of the disk cache. Both tiers are LRU with a byte budget.
+    Every endpoint has its own TTL. Stale responses keep their ETag/Last-Modified to be revalidated.'''
+
+    def __init__(self, directory: str = "cache", ttls: dict | None = None, max_bytes: int = 64 * 1024 * 1024, memory_bytes: int = 8 * 1024 * 1024):
+        '''Initialize cache. ttls is a dictionary of TTLs in seconds by endpoint, 'default' is used for the rest.'''
+        self.directory = directory
+        self.ttls = ttls or {}
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+
+        self.memory = OrderedDict() # {key: (meta, body)} in LRU order
+        self.memory_size = 0
+        self.disk = OrderedDict() # {key: size} in LRU order
+        self.disk_size = 0
+        self.invalidated = {} # Responses stored before this time are stale. {endpoint: time}, None for all endpoints
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stale': 0, 'revalidated': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+
+        self.logger = logging.getLogger(__name__)
+
+        # Create cache directory if it doesn't exist
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+            self.logger.info("Cache directory created")
+
+        self.scan()
+
+    def scan(self) -> None:
+        '''Index responses stored on disk, least recently modified first.'''
+        files = []
+        for file in os.listdir(self.directory):
+            path = os.path.join(self.directory, file)
+            try:
+                # Remove unfinished writes and files of the old cache format (req_<md5>.json)
+                if file.startswith(".req_"):
+                    if time.time() - os.path.getmtime(path) > STALE_TEMP_SECONDS:
+                        os.remove(path)
+                elif file.startswith("req_") and file.count("_") == 1:
+                    os.remove(path)
+                elif file.startswith("req_") and file.endswith(".json"):
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, file[:-len(".json")], stat.st_size))
+            except FileNotFoundError:
+                pass # Renamed or removed by another process
+
+        for _, key, size in sorted(files):
+            self.disk[key] = size
+            self.disk_size += size
+        self.evict()
+        self.logger.info(f"Response cache: {len(self.disk)} responses, {self.disk_size} bytes on disk")
+
+    def endpoint(self, uri: str) -> str:
+        '''Endpoint of uri. 'menus' for menus/1?include=media'''
+        return uri.split("?")[0].split("/")[0]
+
+    def key(self, uri: str) -> str:
+        '''Cache key of uri. Endpoint is a part of the key to invalidate it without reading the files.'''
+        return f"req_{self.endpoint(uri)}_{hashlib.sha256(uri.encode()).hexdigest()}"
+
+    def ttl(self, uri: str) -> int:
+        '''TTL of uri responses in seconds.'''
+        return self.ttls.get(self.endpoint(uri), self.ttls.get('default', 600))
+
+    def get(self, uri: str) -> dict | None:
+        '''Get cached response.
+        Returns dictionary with 'body', 'fresh', 'etag' and 'last_modified' keys or None if there is no cached response.'''
+        cached = self.read(self.key(uri))
+        if cached is None:
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+
+        meta, body = cached
+        fresh = self.is_fresh(uri, meta)
+        if not fresh:
+            with self.lock:
+                self.stats['stale'] += 1
+        return {'body': json.loads(body), 'fresh': fresh, 'etag': meta['etag'], 'last_modified': meta['last_modified']}
+
+    def read(self, key: str) -> tuple | None:
+        '''Read (meta, body) of a response from memory or from disk promoting it to memory.'''
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return self.memory[key]
+            if key not in self.disk:
+                return None
+            self.disk.move_to_end(key)
+
+        try:
+            with open(self.path(key), "r") as file:
+                meta = json.loads(file.readline())
+                body = file.read()
+        except (OSError, ValueError):
+            self.logger.warning(f"Cached response {key} is broken")
+            self.remove(key)
+            return None
+
+        with self.lock:
+            self.stats['disk_hits'] += 1
+            self.remember(key, meta, body)
+        return meta, body
+
+    def is_fresh(self, uri: str, meta: dict) -> bool:
+        '''Check if response is not expired and not invalidated.'''
+        invalidated = max(self.invalidated.get(self.endpoint(uri), 0), self.invalidated.get(None, 0))
+        return meta['stored_at'] > invalidated and time.time() - meta['stored_at'] < self.ttl(uri)
+
+    def put(self, uri: str, body: dict, etag: str | None = None, last_modified: str | None = None) -> None:
+        '''Store response.'''
+        key = self.key(uri)
+        meta = {'uri': uri, 'stored_at': time.time(), 'etag': etag, 'last_modified': last_modified}
+        body = json.dumps(body, separators=(',', ':'))
+        data = json.dumps(meta) + "\n" + body
+
+        # Write to a temporary file and rename it, so readers never see a half-written response
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".req_", suffix=".tmp")
+        with os.fdopen(descriptor, "w") as file:
+            file.write(data)
+        os.replace(temp_path, self.path(key))
+
+        with self.lock:
+            if key in self.disk:
+                self.disk_size -= self.disk.pop(key)
+            self.disk[key] = len(data.encode())
+            self.disk_size += self.disk[key]
+            self.remember(key, meta, body)
+            self.evict()
+
+    def revalidated(self, uri: str) -> None:
+        '''Mark stale response as fresh again after the API answered 304 Not Modified.'''
+        cached = self.read(self.key(uri))
+        if cached is not None:
+            meta, body = cached
+            self.put(uri, json.loads(body), meta['etag'], meta['last_modified'])
+            with self.lock:
+                self.stats['revalidated'] += 1
+
+    def invalidate(self, endpoint: str | None = None, hard: bool = False) -> int:
+        '''Invalidate responses of endpoint or all responses if endpoint is None.
+        Soft invalidation marks responses as stale, they are revalidated by ETag/Last-Modified on the next request.
+        Hard invalidation removes them. Returns number of removed responses.'''
+        if not hard:
+            self.invalidated[endpoint] = time.time()
+            return 0
+
+        with self.lock:
+            keys = [key for key in self.disk if endpoint is None or key.rsplit("_", 1)[0] == f"req_{endpoint}"]
+        for key in keys:
+            self.remove(key)
+        return len(keys)
+
+    def remember(self, key: str, meta: dict, body: str) -> None:
+        '''Put response to memory tier. Lock must be held.'''
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key)[1])
+        # Don't let one huge response push out all the others
+        if len(body) > self.memory_bytes // 4:
+            return
+        self.memory[key] = (meta, body)
+        self.memory_size += len(body)
+        while self.memory_size > self.memory_bytes:
+            _, (_, evicted) = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+    def evict(self) -> None:
+        '''Remove least recently used responses from disk until the cache fits the byte budget. Lock must be held.'''
+        while self.disk_size > self.max_bytes and len(self.disk) > 0:
+            key, size = self.disk.popitem(last=False)
+            self.disk_size -= size
+            self.stats['evictions'] += 1
+            if key in self.memory:
+                self.memory_size -= len(self.memory.pop(key)[1])
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def remove(self, key: str) -> None:
+        '''Remove response from both tiers.'''
+        with self.lock:
+            if key in self.disk:
+                self.disk_size -= self.disk.pop(key)
+            if key in self.memory:
+                self.memory_size -= len(self.memory.pop(key)[1])
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
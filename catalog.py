@@ -0,0 +1,141 @@
+import time
+
+
+class Catalog:
+    '''Snapshot of the data loaded from Tastyigniter API.
+    A snapshot is never changed after it is built. Refresh builds a new snapshot and swaps it in,
+    so readers always see a complete catalog.'''
+
+    # Field name: factory of its empty value
+    fields = {
+        'active_locations': list, # Locations list
+        'locations': dict, # Locations dictionary by location_id
+        'menus': dict, # Menus dictionary by ['location_id']['category_id']
+        'categories': dict, # Categories dictionary by category ID
+        'menu_items': dict, # Menu items dictionary by menu item ID
+        'menu_options': list, # Menu options list
+        'currencies': list, # Currencies list
+        'coupons': list, # Coupons list, indexed by code, location and menu item when the snapshot is created
+        'customers': list, # Customers list
+        'category_locations': dict, # Sets of location IDs by category ID
+        'item_categories': dict, # Sets of category IDs by menu item ID
+        'menu_positions': dict, # Positions of menu items by ['location_id']['category_id']['menu_item_id']
+    }
+
+    def __init__(self, version: int = 0, **fields):
+        '''Create a snapshot. Missing fields are empty.'''
+        for field, factory in self.fields.items():
+            object.__setattr__(self, field, fields[field] if field in fields else factory())
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'loaded_at', time.time())
+        self.index_locations()
+        self.index_coupons()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Catalog snapshot is immutable, can't set {name}")
+
+    def index_locations(self) -> None:
+        '''Index active locations by ID and prepare their display fields: name, address and description.'''
+        active = {}
+        display = {}
+        for location in self.active_locations:
+            location_id = int(location['id'])
+            attributes = location['attributes']
+            active[location_id] = location
+            # Address parts may be empty
+            address = [attributes.get(part) for part in ('location_address_1', 'location_address_2', 'location_city')]
+            display[location_id] = {
+                'name': attributes.get('location_name') or '',
+                'address': ", ".join(str(part).strip() for part in address if part and str(part).strip()),
+                'description': attributes.get('description') or '',
+            }
+        object.__setattr__(self, 'active_by_id', active)
+        object.__setattr__(self, 'location_display', display)
+
+    def index_coupons(self) -> None:
+        '''Index coupons by normalized code and by the locations and menu items they are limited to.'''
+        by_code = {}
+        by_location = {} # Coupons limited to locations by location ID
+        by_menu_item = {} # Coupons limited to menu items by menu item ID
+        coupon_locations = {} # Location IDs of coupons limited to locations by coupon ID
+        coupon_menu_items = {} # Menu item IDs of coupons limited to menu items by coupon ID
+        any_location = [] # Coupons valid in all locations
+
+        for coupon in self.coupons:
+            by_code[self.coupon_code(coupon['attributes']['code'])] = coupon
+            relationships = coupon.get('relationships') or {}
+
+            location_ids = {int(location['id']) for location in (relationships.get('locations') or {}).get('data') or []}
+            if len(location_ids) == 0:
+                any_location.append(coupon)
+            else:
+                coupon_locations[coupon['id']] = frozenset(location_ids)
+                for location_id in location_ids:
+                    by_location.setdefault(location_id, []).append(coupon)
+
+            menu_item_ids = {int(menu['id']) for menu in (relationships.get('menus') or {}).get('data') or []}
+            if len(menu_item_ids) > 0:
+                coupon_menu_items[coupon['id']] = frozenset(menu_item_ids)
+                for menu_item_id in menu_item_ids:
+                    by_menu_item.setdefault(menu_item_id, []).append(coupon)
+
+        object.__setattr__(self, 'coupons_by_code', by_code)
+        object.__setattr__(self, 'coupons_by_location', by_location)
+        object.__setattr__(self, 'coupons_by_menu_item', by_menu_item)
+        object.__setattr__(self, 'coupon_locations', coupon_locations)
+        object.__setattr__(self, 'coupon_menu_items', coupon_menu_items)
+        object.__setattr__(self, 'coupons_any_location', any_location)
+
+    @staticmethod
+    def coupon_code(code: str) -> str:
+        '''Normalized coupon code: users type codes in any case and with spaces around.'''
+        return code.strip().casefold()
+
+    def get_coupon(self, code: str) -> dict | None:
+        '''Coupon by code.'''
+        return self.coupons_by_code.get(self.coupon_code(code))
+
+    def coupon_applies(self, coupon: dict, location_id: int, menu_item_ids) -> bool:
+        '''Check if coupon can be used in location for an order of menu items.
+        Coupon limited to menu items needs at least one of them in the order.'''
+        locations = self.coupon_locations.get(coupon['id'])
+        if locations is not None and location_id not in locations:
+            return False
+        menu_items = self.coupon_menu_items.get(coupon['id'])
+        return menu_items is None or not menu_items.isdisjoint(menu_item_ids)
+
+    def applicable_coupons(self, location_id: int, menu_item_ids) -> list:
+        '''Coupons which can be used in location for an order of menu items.'''
+        candidates = self.coupons_any_location + self.coupons_by_location.get(location_id, [])
+        return [coupon for coupon in candidates if self.coupon_applies(coupon, location_id, menu_item_ids)]
+
+    def replace(self, **fields) -> 'Catalog':
+        '''Return a new snapshot with some fields replaced and the next version.'''
+        current = {field: getattr(self, field) for field in self.fields}
+        current.update(fields)
+        return Catalog(self.version + 1, **current)
+
+    def diff(self, other: 'Catalog') -> dict:
+        '''Compare menu items of this snapshot with a newer one.
+        Returns lists of added, removed and re-priced menu item IDs.'''
+        changes = {'added': [], 'removed': [], 'repriced': []}
+
+        for menu_item_id in other.menu_items:
+            if menu_item_id not in self.menu_items:
+                changes['added'].append(menu_item_id)
+            elif self.price(menu_item_id) != other.price(menu_item_id):
+                changes['repriced'].append(menu_item_id)
+
+        for menu_item_id in self.menu_items:
+            if menu_item_id not in other.menu_items:
+                changes['removed'].append(menu_item_id)
+
+        return changes
+
+    def price(self, menu_item_id: int) -> float:
+        '''Menu item price.'''
+        return self.menu_items[menu_item_id]['data']['attributes']['menu_price']
+
+    def name(self, menu_item_id: int) -> str:
+        '''Menu item name.'''
+        return self.menu_items[menu_item_id]['data']['attributes']['menu_name']
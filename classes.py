@@ -1,26 +1,81 @@
-import os, yaml
-    
+import os, yaml, logging, threading
+from types import MappingProxyType
+
 
 class Config:
+    '''Bot configuration loaded from .config.yml.
+    Values are read-only. Use Config.shared() to get the process-wide instance, it is loaded once and
+    replaced as a whole by reload(), so everybody holding the instance sees the new values.'''
+
+    # Expected types of known options. Options which are missing in the file use defaults of the code
+    types = {
+        'tg-token': str,
+        'tg-concurrent-updates': int,
+        'tg-mode': str,
+        'tg-webhook-url': str,
+        'tg-webhook-listen': str,
+        'tg-webhook-port': int,
+        'tg-webhook-path': str,
+        'tg-webhook-secret': str,
+        'workers': int,
+        'worker-queue-size': int,
+        'catalog-snapshot': str,
+        'catalog-snapshot-check-interval': (int, float),
+        'ti-url': str,
+        'ti-token': str,
+        'ti-api-max-attempts': int,
+        'ti-api-rate-limit': (int, float),
+        'ti-api-burst': (int, float),
+        'ti-api-rate-limits': dict,
+        'ti-api-backoff-base': (int, float),
+        'ti-api-backoff-max': (int, float),
+        'ti-api-concurrency': int,
+        'ti-api-batch-menus': bool,
+        'ti-api-page-size': int,
+        'ti-sync-coupons-interval': (int, float),
+        'ti-sync-menus-interval': (int, float),
+        'ti-location-info-ttl': (int, float),
+        'ti-timezone-offset': (int, float),
+        'dialogue-flush-interval': (int, float),
+        'dialogue-store': str,
+        'dialogue-store-path': str,
+        'dialogue-cache-size': int,
+        'dialogue-idle-timeout': (int, float),
+        'config-reload-interval': (int, float),
+        'ti-api-cache': bool,
+        'ti-api-cache-ttl': dict,
+        'ti-api-cache-max-bytes': int,
+        'ti-api-cache-memory-bytes': int,
+        'ti-currency-code': str,
+        'location-ids': list,
+        'admins': list,
+        'max-quantity': int,
+    }
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
     def __init__(self, filename: str = ".config.yml"):
-        self.c = {}
-        
+        self.filename = filename
+        self.c = MappingProxyType({})
+        self.mtime = None
+        self.logger = logging.getLogger(__name__)
+
         # Check configuration file. If there is no .config.yml file run a sepup.py script
-        if not os.path.isfile(".config.yml"):
-            print("Configuration file .config.yml not found")
+        if not os.path.isfile(filename):
+            print(f"Configuration file {filename} not found")
             print("Running setup.py script...")
             # Run setup.py script
             import setup
             setup.run()
-        
+
         # Load configuration file
         try:
-            with open(filename, 'r') as f:
-                self.c = yaml.load(f, Loader=yaml.FullLoader)
-                # self.config =  yaml.safe_load(open(".config.yml"))
+            self.c, self.mtime = self.read()
         except Exception as e:
             # Log this error to logger
             print("Configuration file is invalid")
+            print(e)
             print("Please check your configuration file")
             # Offer to run setup.py script
             print("Do you want to run setup.py script? (y/n)")
@@ -32,22 +87,90 @@ class Config:
                 setup.run()
             else:
                 exit(0)
-        
-    def get(self, key):
-        return self.c[key]
-    
-    def set(self, key, value):
-        self.c[key] = value
-    
+
+    @classmethod
+    def shared(cls, filename: str = ".config.yml") -> 'Config':
+        '''Process-wide configuration, loaded on the first call.'''
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(filename)
+            return cls._shared
+
+    def read(self) -> tuple:
+        '''Read and check configuration file. Returns (read-only values, file mtime).'''
+        mtime = os.stat(self.filename).st_mtime
+        with open(self.filename, 'r') as f:
+            values = yaml.load(f, Loader=yaml.FullLoader)
+        if not isinstance(values, dict):
+            raise ValueError("Configuration file must be a mapping of options")
+
+        errors = []
+        for key, expected in self.types.items():
+            if key in values and values[key] is not None and not isinstance(values[key], expected):
+                errors.append(f"{key} must be {self.type_name(expected)}, not {type(values[key]).__name__}")
+        if len(errors) > 0:
+            raise ValueError("; ".join(errors))
+
+        return self.freeze(values), mtime
+
+    def reload(self) -> bool:
+        '''Load configuration file again. Invalid file is logged and the current values are kept.'''
+        try:
+            self.c, self.mtime = self.read()
+        except Exception as e:
+            self.logger.error(f"Configuration is not reloaded: {e}")
+            return False
+        self.logger.info(f"Configuration reloaded from {self.filename}")
+        return True
+
+    def reload_if_changed(self) -> bool:
+        '''Reload configuration if the file was modified. Returns True if it was reloaded.'''
+        try:
+            mtime = os.stat(self.filename).st_mtime
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return False
+        # Don't retry an invalid file until it is modified again
+        self.mtime = mtime
+        return self.reload()
+
+    @classmethod
+    def freeze(cls, value):
+        '''Read-only copy of loaded values: dictionaries become mapping proxies, lists become tuples.'''
+        if isinstance(value, dict):
+            return MappingProxyType({key: cls.freeze(item) for key, item in value.items()})
+        if isinstance(value, list):
+            return tuple(cls.freeze(item) for item in value)
+        return value
+
+    @classmethod
+    def thaw(cls, value):
+        '''Plain dictionaries and lists of read-only values.'''
+        if isinstance(value, MappingProxyType):
+            return {key: cls.thaw(item) for key, item in value.items()}
+        if isinstance(value, tuple):
+            return [cls.thaw(item) for item in value]
+        return value
+
+    @staticmethod
+    def type_name(expected) -> str:
+        if isinstance(expected, tuple):
+            return " or ".join(t.__name__ for t in expected)
+        return expected.__name__
+
+    def get(self, key, default=None):
+        return self.c.get(key, default)
+
     def save(self, filename):
         with open(filename, 'w') as f:
-            yaml.dump(self.c, f)
-            
+            yaml.dump(self.thaw(self.c), f)
+
     def __str__(self):
-        return str(self.c)
-    
+        return str(self.thaw(self.c))
+
     def __repr__(self):
-        return str(self.c)
-    
+        return str(self.thaw(self.c))
+
     def __getitem__(self, key):
-        return self.c[key]
\ No newline at end of file
+        return self.c[key]
@@ -1,105 +1,40 @@
 from classes import Config
-import json, os, random, string, logging, re
+from dialogue_store import JsonDialogueStore, open_store
+from models import Cart, CartLine, Navigation, UserProfile, new_order
+import asyncio, json, random, string, logging, re, sqlite3, time
+from contextlib import asynccontextmanager
+from collections import OrderedDict
 from telegram.error import BadRequest
 
 class Dialogue:
     '''Class for storing user dialogs.'''
-    def __init__(self, user_id, is_admin: bool = False):
-        self.config = Config()
+
+    __slots__ = ('config', 'user_id', 'user', 'nav', 'cart', 'context', 'update', 'dirty', 'on_change', 'store', 'is_admin',
+                 'reply_text', 'reply_markup', 'nav_buttons', 'keyboard', 'image', 'home_button', 'cart_button', 'existed_message', 'text_filtered')
+
+    # Version of the compact serialization format
+    format = 2
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, user_id, is_admin: bool = False, on_change=None, store=None, config: Config | None = None):
+        '''on_change is called with the dialogue when it has unsaved changes. store is a dialogue storage backend.
+        config is shared by all dialogues, the process-wide one by default.'''
+        self.config = config if config is not None else Config.shared()
         self.user_id = user_id # Telegram user ID
-        self.user = {
-            'first_name': None,
-            'last_name': None,
-            'phone': None,
-            'location': None,
-            'address': None,
-            'coupon': None,
-            'ti-customer': {},
-            'order': {
-                # Required
-                'customer_id': None,
-                'location_id': None,
-                'first_name':  None,
-                'last_name':  None,
-                'email': self.config['ti-customer']['email'],
-                'order_type': 'delivery', # delivery | collection (for pick-up)
-                'delivery_address': None,
-                'payment_method': 'cod',
-                'total_items' : 0,
-                'order_total': 0.0,
-                'order_totals': [
-                    {
-                        # 'order_total_id': 792, ??? What is this?
-                        'order_id': 0,
-                        'code': 'subtotal',
-                        'title': 'Sub Total',
-                        'value': 0.0,
-                        'priority': 0,
-                        'is_summable': 0
-                    },
-                    {
-                        # 'order_total_id': 791,
-                        'order_id': 0,
-                        'code': 'delivery',
-                        'title': 'Delivery',
-                        'value': 0.0,
-                        'priority': 100,
-                        'is_summable': 1
-                    },
-                    {
-                        # 'order_total_id': 793,
-                        'order_id': 0,
-                        'code': 'total',
-                        'title': 'Order Total',
-                        'value': 0.0,
-                        'priority': 127,
-                        'is_summable': 0
-                    }
-                ],
-                'order_menus': [],
-                
-                # Optional
-                'telephone': None,
-                'comment': None,
-                'delivery_comment': None,
-                'order_time_is_asap': True,
-                'order_date': None,
-                'order_time': None,
-                'payment': 'cod', # cod | card
-                'processed': 0,
-                'status_id': 0,
-                'status_comment': None,
-            }
-        }
+        self.user = UserProfile(order=new_order(self.config['ti-customer']['email']))
         # Navigation
-        self.nav = {
-            'current_location': None,
-            'current_category': None,
-            'current_menu_item': None,
-            'current_menu_item_options': None,
-            'requested': {
-                'user_location': False, # Had user requested to send his location?
-                'user_phone': False, # Had user requested to send his phone number?
-            },
-            'text_requested_for': None,
-            'after_request_screen': None,
-            'message_ids': [], # Message IDs we sent to user. Used for deleting messages.
-        }
-        self.cart = []
+        self.nav = Navigation()
+        self.cart = Cart()
         self.context = None
         self.update = None
+        self.dirty = False # Has changes which are not written to disk yet
+        self.on_change = on_change
+        self.store = store if store is not None else JsonDialogueStore()
 
         self.new_answer()
 
-        # Set up the logger
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S',
-        )
-        self.logger = logging.getLogger(__name__)
-
-        # Load user dialog from json file
+        # Load user dialog from the store
         self.load()
 
         self.is_admin = is_admin
@@ -119,44 +54,48 @@ class Dialogue:
         # Send new message or edit existing one
         self.existed_message = False
 
+        # Reply text is already filtered by filter_text()
+        self.text_filtered = False
+
     def save(self):
-        '''Save user dialog to json file.'''
-        # Create a dictionary for storing user dialog
+        '''Mark user dialog as changed. It is written to the store later by DialoguesManager.flush().'''
+        self.dirty = True
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def dump(self) -> str:
+        '''Serialize user dialog to compact json. Only values which differ from defaults are stored.'''
         dialogue = {
-            'user_id': self.user_id,
-            'nav': self.nav,
-            'cart': self.cart,
-            'user': self.user
+            'v': self.format,
+            'id': self.user_id,
+            'nav': self.nav.compact(),
+            'cart': self.cart.compact(),
+            'user': self.user.compact(),
         }
-        # Save user dialog to json file
-        with open(f"cache/user_{int(self.user_id)}.json", "w") as file:
-            json.dump(dialogue, file, default=[])
-        file.close()
+        return json.dumps(dialogue, separators=(',', ':'), default=list)
 
     def load(self):
-        '''Load user dialog from json file.'''
-        # Check if user dialog file exists
-        if not os.path.isfile(f"cache/user_{int(self.user_id)}.json"):
-            print(f"User dialog file {int(self.user_id)}.json not found")
+        '''Load user dialog from the store.'''
+        dialogue = self.store.load(self.user_id)
+        if dialogue is None:
+            self.logger.info(f"User dialog {int(self.user_id)} not found in the store")
             return False
 
-        # Load user dialog from json file
-        with open(f"cache/user_{int(self.user_id)}.json", "r") as file:
-            dialogue = json.load(file)
-   
+        # Dialogues saved before the compact format have full dictionaries, unknown and empty keys are skipped
+        nav = {key: value for key, value in dialogue['nav'].items() if key in Navigation.defaults and value is not None and Config.freeze(value) != Navigation.defaults[key]}
+        user = {key: value for key, value in dialogue['user'].items() if key in UserProfile.defaults and key != 'order' and Config.freeze(value) != UserProfile.defaults[key]}
+
         # Update user dialog
-        self.user_id = dialogue['user_id']
-        self.nav = dialogue['nav']
-        if self.nav['message_ids'] is None:
-            self.nav['message_ids'] = []
-        self.cart = dialogue['cart']
-        self.user = dialogue['user']
-        file.close()
+        self.user_id = dialogue.get('id', dialogue.get('user_id'))
+        self.nav = Navigation(**nav)
+        self.nav['message_ids'] = list(self.nav['message_ids'])
+        self.cart = Cart(dialogue['cart'])
+        self.user = UserProfile(**user, order=new_order(self.config['ti-customer']['email'], dialogue['user'].get('order')))
         return True
 
     def update_cart(self, cart):
         '''Update user cart.'''
-        self.cart = cart
+        self.cart = cart if isinstance(cart, Cart) else Cart(cart)
         self.save()
   
     def update_nav(self, key: str, value: str | dict):
@@ -179,64 +118,47 @@ class Dialogue:
         '''Append item to user cart.'''
         # Generate unique ID for this item in cart
         uid = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+        while uid in self.cart:
+            uid = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(8))
   
-        self.cart.append({
-            'uid': uid,
-            'id': item_id,
-            'quantity': quantity,
-            'options': [],
-        })
+        self.cart.add(CartLine(uid, item_id, quantity))
         self.save()
         return uid
 
     def cart_remove(self, uid) -> None:
         '''Remove item from user cart.'''
-        for item in self.cart:
-            if item['uid'] == uid:
-                self.cart.remove(item)
-                self.save()
+        if self.cart.remove(uid) is not None:
+            self.save()
 
     def cart_set_quantity(self, uid, quantity) -> None:
         '''Update item quantity in user cart.'''
-        for item in self.cart:
-            if item['uid'] == uid:
-                item['quantity'] = quantity
-                self.save()
+        if uid in self.cart:
+            self.cart.set_quantity(uid, quantity)
+            self.save()
     
     def cart_set_option(self, uid, option) -> None:
         '''Update item option in user cart.'''
-        for item in self.cart:
-            if item['uid'] == uid:
-                item['options'].append(option)
-                self.save()
+        if uid in self.cart:
+            self.cart.add_option(uid, option)
+            self.save()
  
     def cart_clear(self) -> None:
         '''Clear user cart.'''
-        self.cart = []
+        self.cart.clear()
         self.save()
 
     def cart_count(self) -> int:
         '''Count items in user cart.'''
-        count = 0
-        for item in self.cart:
-            count += item['quantity']
-        return count
+        return self.cart.count
 
     def cart_options_count(self, uid) -> int:
         '''Count options in user cart.'''
-        count = 0
-        for item in self.cart:
-            if item['uid'] == uid:
-                count = len(item['options'])
-        return count
+        item = self.cart.get(uid)
+        return len(item.options) if item is not None else 0
 
-    def cart_get_item(self, uid) -> dict:
+    def cart_get_item(self, uid) -> CartLine | None:
         '''Get item from user cart.'''
-        item_in_cart = None
-        for item in self.cart:
-            if item['uid'] == uid:
-                item_in_cart = item
-        return item_in_cart
+        return self.cart.get(uid)
     
     def set_order_type(self, order_type: str) -> None:
         '''Set order type.'''
@@ -245,14 +167,10 @@ class Dialogue:
     
     def nav_reset(self) -> None:
         '''Clear user navigation.'''
-        for key in self.nav:
-            self.nav[key] = None
+        self.nav.reset()
         self.save()
     
         '''Check if user is admin.'''
-        # Load config
-        self.config = Config()
-        
         if self.user_id in self.config['admins']:
             return True
         return False
@@ -263,8 +181,7 @@ class Dialogue:
         
         if current_location is None:
             # set to first location in config
-            config = Config()
-            current_location = config['location-ids'][0]
+            current_location = self.config['location-ids'][0]
             self.update_nav('current_location', current_location)
             self.logger.warning(f"User {self.user_id} has no current location. Set to {current_location}")
 
@@ -272,7 +189,8 @@ class Dialogue:
         
         return int(current_location)
 
-    def filter_text(self, text: str) -> str:
+    @staticmethod
+    def filter_text(text: str) -> str:
         # List of allowed HTML tags
         allowed_tags = ['b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'span', 'a', 'code', 'pre']
         
@@ -304,19 +222,37 @@ class DialoguesManager:
     '''Class for managing user dialogs.'''
     def __init__(self, config):
         '''Initialize DialogsManager class.'''
-        self.dialogues = {}
+        self.dialogues = OrderedDict() # Resident dialogues by user ID, least recently used first
+        self.last_seen = {} # Time of the last update by user ID
+        self.dirty = {} # Dialogues with unsaved changes by user ID. Evicted dialogues stay here until written
+        self.locks = {} # [lock, number of updates holding or waiting for it] by user ID, only while updates are processed
         self.config = config
         self.logger = self.logger()
+        self.store = open_store(config)
+
+        # Resident dialogues limit and seconds of inactivity before a dialogue is evicted. 0 disables the limit
+        self.max_dialogues = config.get('dialogue-cache-size', 10000)
+        self.idle_timeout = config.get('dialogue-idle-timeout', 3600)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
 
     def get_dialog(self, tg_user: dict) -> Dialogue:
         '''Get user dialog from the list of dialogs.'''
-        # Create a new dialogue for this user in global dialogues dictionary
-        if tg_user['id'] not in self.dialogues:
+        if tg_user['id'] in self.dialogues:
+            self.stats['hits'] += 1
+            self.dialogues.move_to_end(tg_user['id'])
+        elif tg_user['id'] in self.dirty:
+            # Evicted while its changes are waiting for the flush, bring it back
+            self.stats['misses'] += 1
+            self.dialogues[tg_user['id']] = self.dirty[tg_user['id']]
+        else:
+            self.stats['misses'] += 1
             # check if user is admin
             is_admin = False if tg_user['id'] not in self.config['admins'] else True
-            # Create new dialogue 
-            self.dialogues[tg_user['id']] = Dialogue(tg_user['id'], is_admin)
-            self.logger.info(f"Created new dialogue for user {tg_user['id']}")
+            # Load dialogue from the store or create a new one
+            self.dialogues[tg_user['id']] = Dialogue(tg_user['id'], is_admin, on_change=self.mark_dirty, store=self.store, config=self.config)
+            self.logger.debug(f"Loaded dialogue for user {tg_user['id']}")
+        self.last_seen[tg_user['id']] = time.monotonic()
+        self.evict()
         
         # Update user name if it has changed
         if self.dialogues[tg_user['id']].user['first_name'] != tg_user['first_name'] or self.dialogues[tg_user['id']].user['last_name'] != tg_user['last_name']:
@@ -326,20 +262,103 @@ class DialoguesManager:
 
     def remove_dialog(self, user_id: int) -> None:
         '''Remove user dialog from the list of dialogs.'''
-        # Delete cached user json file from cache folder named by user ID.json
-        filename = f"cache/user_{int(user_id)}.json"
-        if os.path.isfile(filename):
-            self.logger.info(f"Deleting cached user file {filename}")
-            os.remove(filename)
+        # Delete stored user dialog
+        if self.store.delete(user_id):
+            self.logger.info(f"Deleted stored dialogue of user {user_id}")
         else:
-            self.logger.warning(f"Can't delete cached user file {filename}. File not found.")
+            self.logger.warning(f"Can't delete stored dialogue of user {user_id}. Not found.")
         
+        self.dirty.pop(user_id, None)
+        self.last_seen.pop(user_id, None)
         if user_id in self.dialogues:
             self.dialogues.pop(user_id)
             self.logger.info(f"Removed dialogue for user {user_id}")
         else:
             self.logger.warning(f"Can't remove dialogue for user {user_id}. Dialogue not found.")
 
+    @asynccontextmanager
+    async def user_lock(self, user_id: int):
+        '''Hold the lock of the user while the update is processed.
+        Updates of one user wait for each other in the order they came, updates of different users run concurrently.'''
+        entry = self.locks.get(user_id)
+        if entry is None:
+            entry = self.locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            # Drop the lock when no more updates of the user are waiting for it
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[user_id]
+
+    def mark_dirty(self, dialogue: Dialogue) -> None:
+        '''Remember dialogue to be written on the next flush.'''
+        self.dirty[dialogue.user_id] = dialogue
+
+    def flush(self) -> int:
+        '''Write all changed dialogues to disk. Returns number of written dialogues.'''
+        dirty, self.dirty = self.dirty, {}
+        return self.write(dirty)
+
+    def write(self, dialogues: dict) -> int:
+        '''Write dialogues {user_id: Dialogue} to the store. Returns number of written dialogues.'''
+        data = {}
+        for user_id, dialogue in dialogues.items():
+            data[user_id] = dialogue.dump()
+            dialogue.dirty = False
+        try:
+            self.store.save_many(data)
+        except (OSError, sqlite3.Error) as e:
+            # Keep them dirty to retry on the next flush
+            for user_id, dialogue in dialogues.items():
+                dialogue.dirty = True
+                self.dirty.setdefault(user_id, dialogue)
+            self.logger.error(f"Can't save {len(dialogues)} dialogues: {e}")
+            return 0
+        return len(data)
+
+    def evict(self) -> int:
+        '''Drop least recently used dialogues above the limit and idle dialogues. Their changes are written first.
+        Returns number of evicted dialogues.'''
+        evicted = {}
+        now = time.monotonic()
+        while len(self.dialogues) > 0:
+            # The first dialogue is the least recently used one, so it is also idle for the longest time
+            user_id = next(iter(self.dialogues))
+            over_limit = self.max_dialogues and len(self.dialogues) > self.max_dialogues
+            idle = self.idle_timeout and now - self.last_seen.get(user_id, 0) > self.idle_timeout
+            if not over_limit and not idle:
+                break
+            evicted[user_id] = self.dialogues.pop(user_id)
+            self.last_seen.pop(user_id, None)
+
+        if len(evicted) == 0:
+            return 0
+        self.stats['evictions'] += len(evicted)
+        self.write({user_id: self.dirty.pop(user_id) for user_id in evicted if user_id in self.dirty})
+        return len(evicted)
+
+    def metrics(self) -> dict:
+        '''Dialogue cache metrics: resident dialogues, hit rate, evictions and unsaved dialogues.'''
+        requests = self.stats['hits'] + self.stats['misses']
+        return {
+            'resident': len(self.dialogues),
+            'hit_rate': self.stats['hits'] / requests if requests else 0.0,
+            'hits': self.stats['hits'],
+            'misses': self.stats['misses'],
+            'evictions': self.stats['evictions'],
+            'dirty': len(self.dirty),
+            'busy_users': len(self.locks),
+        }
+
+    def close(self) -> int:
+        '''Write changed dialogues and close the store. Returns number of written dialogues.'''
+        written = self.flush()
+        self.store.close()
+        return written
+
     def send_message(self, tg_user: dict, text: str, reply_markup=None, parse_mode=None, disable_web_page_preview=None) -> int:
         '''Send message to user.'''
         # Get user dialog
@@ -0,0 +1,173 @@
+'''Storage backends for user dialogues.
+Run "python3 dialogue_store.py migrate" to import user_*.json files into the SQLite store.'''
+
+import json, os, glob, logging, sqlite3, tempfile, threading, time, sys
+
+from cache import STALE_TEMP_SECONDS
+
+
+class JsonDialogueStore:
+    '''One json file per user in the cache directory.'''
+
+    def __init__(self, directory: str = "cache"):
+        self.directory = directory
+        self.logger = logging.getLogger(__name__)
+
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+
+        # Remove unfinished writes
+        for path in glob.glob(os.path.join(directory, ".user_*.tmp")):
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_TEMP_SECONDS:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass # Renamed or removed by another process
+
+    def path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"user_{int(user_id)}.json")
+
+    def load(self, user_id: int) -> dict | None:
+        '''Load user dialogue or None if it is not stored.'''
+        try:
+            with open(self.path(user_id), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            self.logger.warning(f"Dialogue file of user {user_id} is broken")
+            return None
+
+    def save_many(self, dialogues: dict) -> None:
+        '''Store serialized dialogues: {user_id: json}.'''
+        for user_id, data in dialogues.items():
+            # Write to a temporary file and rename it, so the file is never half-written
+            descriptor, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".user_", suffix=".tmp")
+            with os.fdopen(descriptor, "w") as file:
+                file.write(data)
+            os.replace(temp_path, self.path(user_id))
+
+    def delete(self, user_id: int) -> bool:
+        '''Delete user dialogue. Returns False if it is not stored.'''
+        try:
+            os.remove(self.path(user_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def user_ids(self) -> list:
+        '''IDs of all stored users.'''
+        user_ids = []
+        for path in glob.glob(os.path.join(self.directory, "user_*.json")):
+            name = os.path.basename(path)[len("user_"):-len(".json")]
+            if name.isdigit():
+                user_ids.append(int(name))
+        return user_ids
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteDialogueStore:
+    '''All dialogues in one SQLite table. WAL mode lets readers work while a flush is written.'''
+
+    def __init__(self, path: str = "cache/dialogues.sqlite3"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.mkdir(directory)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # WAL is consistent after a crash with NORMAL sync, only the last flush may be lost
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA busy_timeout=5000")
+        # user_id is the primary key, so lookups by user use its index
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS dialogues ("
+            "user_id INTEGER PRIMARY KEY, "
+            "data TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+
+    def load(self, user_id: int) -> dict | None:
+        '''Load user dialogue or None if it is not stored.'''
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM dialogues WHERE user_id = ?", (int(user_id),)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            self.logger.warning(f"Stored dialogue of user {user_id} is broken")
+            return None
+
+    def save_many(self, dialogues: dict) -> None:
+        '''Store serialized dialogues: {user_id: json} in one transaction.'''
+        if len(dialogues) == 0:
+            return
+        now = time.time()
+        rows = [(int(user_id), data, now) for user_id, data in dialogues.items()]
+        with self.lock:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                self.connection.executemany(
+                    "INSERT INTO dialogues (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    rows,
+                )
+
+    def delete(self, user_id: int) -> bool:
+        '''Delete user dialogue. Returns False if it is not stored.'''
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM dialogues WHERE user_id = ?", (int(user_id),))
+        return cursor.rowcount > 0
+
+    def user_ids(self) -> list:
+        '''IDs of all stored users.'''
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT user_id FROM dialogues")]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+def open_store(config) -> JsonDialogueStore | SqliteDialogueStore:
+    '''Create dialogue store selected by 'dialogue-store' config option: json or sqlite.'''
+    backend = config.get('dialogue-store', 'json')
+    if backend == 'sqlite':
+        return SqliteDialogueStore(config.get('dialogue-store-path', "cache/dialogues.sqlite3"))
+    if backend != 'json':
+        raise ValueError(f"Unknown dialogue store: {backend}")
+    return JsonDialogueStore(config.get('dialogue-store-directory', "cache"))
+
+
+def migrate(directory: str = "cache", path: str = "cache/dialogues.sqlite3") -> int:
+    '''Import user_*.json files into the SQLite store. Returns number of imported dialogues.
+    Files are kept, so the bot can be switched back to the json store.'''
+    source = JsonDialogueStore(directory)
+    target = SqliteDialogueStore(path)
+
+    dialogues = {}
+    for user_id in source.user_ids():
+        dialogue = source.load(user_id)
+        if dialogue is not None:
+            dialogues[user_id] = json.dumps(dialogue)
+    target.save_many(dialogues)
+    target.close()
+    return len(dialogues)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python3 dialogue_store.py migrate [cache directory] [sqlite path]")
+        exit(1)
+
+    logging.basicConfig(level=logging.INFO)
+    imported = migrate(*sys.argv[2:4])
+    print(f"Imported {imported} dialogues")
+    print("Set 'dialogue-store: sqlite' in .config.yml to use them")
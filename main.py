@@ -4,17 +4,26 @@ This bot provides a frontend for online food ordering on Telegram using Testigni
 GitHub https://github.com/troioi-vn/tele-igniter
 '''
 
-import logging
+import logging, asyncio, os, signal
 
-from dialogue import DialoguesManager
+from dialogue import Dialogue, DialoguesManager
 from tastyigniter import TastyIgniter
+from pricing import PricingEngine
+from render import RenderCache, Screen
+from router import Callback, CallbackRouter
+from snapshot import SnapshotReader
 from classes import Config
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, filters
+from telegram.ext import Application, BaseUpdateProcessor, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
 from telegram.constants import ParseMode, MessageEntityType
 from telegram.error import BadRequest
 
+logger = logging.getLogger(__name__)
+
+# Button handlers are registered below by callback_data prefix
+router = CallbackRouter()
+
 
 async def process_usser_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """ All user actions are handled here.
@@ -58,628 +67,26 @@ async def process_usser_action(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.info(f"User {dialogue.user_id} pressed button {query.data}")
 
         location_id = dialogue.nav_get_current_location()
-
-        # Handle home section (location selection)
-        if query.data.startswith("location-"):
-            location_id = int(query.data.split("-")[1])
-            menu = ti.menus[location_id]
-            dialogue.home_button = False
-            
-    
-            # Check if location is active
-            if location_id not in [int(location['id']) for location in ti.active_locations]:
-                logger.warning(f"User {dialogue.user_id} tried to select inactive location {location_id}")
-                return
-    
-            # Save current location ID to dialogue
-            dialogue.update_nav('current_location', location_id)
-
-            location = ti.get_location_info(location_id)
-            
-            # Add location name to reply text
-            dialogue.reply_text += f"📍<b>{location['attributes']['location_name']}</b>"
-            
-            # If user is admin, add admin tag
-            if dialogue.user_id in config['admins']:
-                dialogue.reply_text += f" [admin]"
-            
-            # Add location description to reply text
-            dialogue.reply_text += f"\n{location['attributes']['description']}"
-                        
-            location_statuses = ti.get_location_statuses(location_id)
-            
-            dialogue.reply_text += "\n"
-            
-            if location_statuses['delivery']['status']:
-                dialogue.reply_text += f"\n✅ Delivery until {location_statuses['delivery']['ends']}"
-            else:
-                dialogue.reply_text += f"\n⏸ Delivery will open at {location_statuses['delivery']['starts']}"
-            
-            if location_statuses['pickup']['status']:
-                dialogue.reply_text += f"\n✅ Pickup until {location_statuses['pickup']['ends']}"
-            else:
-                dialogue.reply_text += f"\n⏸ Pickup will open at {location_statuses['pickup']['starts']}"
-            
-            # Offer to select a category 
-            for category_id in menu:
-                category = ti.categories[category_id]
-                # Add categories to keyboard
-                dialogue.keyboard.append([InlineKeyboardButton(category['attributes']['name'], callback_data="category-"+str(category_id))])
-    
-            if len(dialogue.keyboard) > 0:
-                dialogue.reply_text += "\n\n" + "Please select a category"
-            else:
-                dialogue.reply_text += "\n\n" + "There are no categories for this location"
-            
-            # Admin buttons
-            if dialogue.is_admin:
-                # Reload button
-                dialogue.nav_buttons.append([InlineKeyboardButton("🔄 Reload", callback_data="admin-reload")])
-                
-        # Handle category section
-        elif query.data.startswith("category-"):
-            category_id = int(query.data.split("-")[1])
-            menu = ti.menus[location_id]
-    
-            # Save current category ID to dialogue
-            dialogue.update_nav('current_category', category_id)
-    
-            # Add category name to reply text
-            dialogue.reply_text += f"<b>{ti.categories[category_id]['attributes']['name']}</b>"
-    
-            # Offer to select an item
-            for item_id in ti.menus[location_id][category_id]:
-                item = ti.menu_items[item_id]
-                # Format price with spaces after every 3 digits from the end
-                price = ti.format_amount(item['data']['attributes']['menu_price'], item['data']['attributes']['currency'])
-                
-                # Add items to keyboard
-                dialogue.keyboard.append([InlineKeyboardButton(f"{item['data']['attributes']['menu_name']} {price}", callback_data="item-"+str(item_id))])
-            
-            if len(dialogue.keyboard) > 0:
-                dialogue.reply_text += "\n\n" + "Please select an item"
-            else:
-                dialogue.reply_text += "\n\n" + "There are no items in this category"
-    
-            # Create back button to location
-            dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="location-"+str(dialogue.nav['current_location']))])
-            
-        # Handle item section 
-        elif query.data.startswith("item-"): # Format "item-{id}-{action}-{params}"
-            # Get item ID from button data
-            item_id = int(query.data.split("-")[1])
-            # Get action 
-            action = query.data.split("-")[2] if len(query.data.split("-")) > 2 else None
-            # Get parameters
-            params = query.data.split("-")[3] if len(query.data.split("-")) > 3 else None
-    
-            # Get item data
-            item = ti.menu_items[item_id]['data']
-    
-            category_id = dialogue.nav['current_category']
-            menu = ti.menus[location_id]
-
-            # Show item main screen
-            if action == None:  
-                # Add item name to reply text
-                dialogue.reply_text = f"<b>{item['attributes']['menu_name']}</b>"
-        
-                # Count this items in cart and add to reply text
-                current_item_quantity = dialogue.cart_count()
-                if current_item_quantity > 0:
-                    # Count items with the same ID
-                    current_item_quantity = sum(item['quantity'] for item in dialogue.cart if item['id'] == item_id)
-
-                # Add item quantity to reply text
-                if current_item_quantity > 0:
-                    dialogue.reply_text += f" (in a cart: {current_item_quantity})"
-                    
-                # Add item description to reply text
-                dialogue.reply_text += f"\n\n{item['attributes']['menu_description']}"
-
-                # Add item price to reply text
-                dialogue.reply_text += "\n\n" + f"Price: {ti.format_amount(item['attributes']['menu_price'], item['attributes']['currency'])} {item['attributes']['currency']}"
-                
-                # Check is there image for this item
-                if 'included' in ti.menu_items[item_id]:
-                    for attachment in ti.menu_items[item_id]['included']:
-                        if attachment['type'] == 'media':
-                            dialogue.image = attachment['attributes']['path']
-
-                # Create add to cart button
-                dialogue.keyboard.append([InlineKeyboardButton("🛒 Add to cart", callback_data=f"item-{str(item_id)}-addtocart")])
-                # Handle item navigation
-                keyboard_row = []
-                # Create back button to category
-                keyboard_row.append(InlineKeyboardButton("⬅️ Back", callback_data="category-"+str(dialogue.nav['current_category'])))
-        
-                # If there are more than one item in this menu category build navigation buttons
-                if len(menu[category_id]) > 1:
-                    # Find current item index in menu[category_id]
-                    current_item_index = menu[category_id].index(item_id)
-
-                    # Add to reply text N of M
-                    dialogue.reply_text += f"\n\n{current_item_index+1} of {len(menu[category_id])}"
-
-                    # Find previous item id in menu[category_id] if current item is not the first one
-                    if current_item_index > 0:
-                        previous_item_id = menu[category_id][current_item_index-1]
-                        keyboard_row.append(InlineKeyboardButton("<<<", callback_data="item-"+str(previous_item_id)))
-                
-                    # Find next item id in menu[category_id] if current item is not the last one
-                    if current_item_index < len(menu[category_id])-1:
-                        next_item_id = menu[category_id][current_item_index+1]
-                        keyboard_row.append(InlineKeyboardButton(">>>", callback_data="item-"+str(next_item_id)))
-            
-                # Add keyboard row to keyboard
-                if len(keyboard_row) > 0:
-                    dialogue.keyboard.append(keyboard_row)
-
-            # Handling Add to Cart
-            elif action == "addtocart":
-                # Ask the user for a quantity
-                if params == None:
-                    # Add text to reply
-                    dialogue.reply_text += "\n\nHow many?"
-            
-                    # Add quantity buttons.
-                    keyboard_row = []
-                    for i in range(1, 6):
-                        keyboard_row.append(InlineKeyboardButton(str(i), callback_data=f"item-{str(item_id)}-addtocart-{str(i)}"))
-                        if i % 3 == 0:
-                            dialogue.keyboard.append(keyboard_row)
-                            keyboard_row = []
-                    # Add last row if it is not full
-                    if len(keyboard_row) > 0:
-                        dialogue.keyboard.append(keyboard_row)
-
-                    # Create back button to item
-                    dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="item-"+str(item_id))])
-
-                # Add an item to cart and ask for options if there are any
-                # Check if quantity is valid
-                elif int(params) > 0 and int(params) <= config['max-quantity']:
-                    # Get quantity from params
-                    quantity = int(params)    
-        
-                    # Check quantity is in reasonable range
-                    if quantity < 1 or quantity > config['max-quantity']:
-                        quantity = 1
-                        logging.warning(f"Quantity {quantity} is out of range (1-{config['max-quantity']})")
-                        
-                    # Add item to the cart and get its uid
-                    uid = dialogue.cart_append(item_id, quantity)
-                    dialogue.cart_button = True
-
-                    # Add text to reply
-                    dialogue.reply_text += f"{quantity} x {item['attributes']['menu_name']} added to your cart ✅"
-
-                    available_item_options = ti.get_item_options(item_id)
-                    # Ask user for an option if there are any                
-                    if len(available_item_options) > 0:
-                        dialogue.nav['current_menu_item_options'] = available_item_options[0]
-                        option = available_item_options[0] # Get first option. This is a temporary solution.
-        
-                        # Check if there are unselected options
-                        if len(available_item_options) > dialogue.cart_options_count(uid):
-                            # Ask user for an option
-                            dialogue.reply_text = f"Please select an option."
-
-                            # Add option name to
-                            dialogue.reply_text += f"\n\n<b>{option['attributes']['option_name']}</b>"
-            
-                            # Add buttons for each option value
-                            default_option_value_id = None
-                            for option_value in option['attributes']['menu_option_values']:
-                                # Check if this option is default
-                                if option_value['is_default']:
-                                    default_option_value_id = option_value['menu_option_value_id']
-
-                                # Add option button
-                                dialogue.keyboard.append([InlineKeyboardButton(f"{option_value['name']} (+{ti.format_amount(option_value['price'], item['attributes']['currency'])})", callback_data=f"cart-{str(uid)}-setoption-{str(option_value['menu_option_value_id'])}")])
-                            
-                            # Add Skip button if option is not required and default option value is set
-                            if not option['attributes']['required']:
-                                dialogue.keyboard.append([InlineKeyboardButton(f"Skip", callback_data=f"cart-{str(uid)}-setoption-{str(default_option_value_id)}")])
-
-                            # Disable home and cart buttons
-                            dialogue.home_button = False
-                            dialogue.cart_button = False
-
-                        # There are no unselected options
-                        else:
-                            dialogue.cart_button = True
-                            print("!!!!")
-    
-                    # Create back to the item button
-                    dialogue.keyboard.append([InlineKeyboardButton(f"⬅️ {item['attributes']['menu_name']}", callback_data=f"item-{str(item_id)}")])
-
-                    # Create cancel button leadeing to remove item from cart
-                    dialogue.keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data="cart-"+str(uid)+"-remove")])
-                else:
-                    # Set reply text
-                    dialogue.reply_text = "Invalid quantity"
-                    # Create back button to item
-                    dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="item-"+str(item_id))])
-
-        # Handle cart and cart actions
-        elif query.data.startswith("cart"): # Format: "cart-{uid}-{action}-{params}"
-            # Get uid from query if exists
-            uid = query.data.split("-")[1] if len(query.data.split("-")) > 1 else None
-            # Get action from query
-            action = query.data.split("-")[2] if len(query.data.split("-")) > 2 else None
-            # Get params from query
-            params = query.data.split("-")[3] if len(query.data.split("-")) > 3 else None
-    
-            dialogue.cart_button = False
-    
-            # Handle cart
-            if action == None:
-                # Check if cart is empty
-                if dialogue.cart_count() == 0:
-                    dialogue.reply_text += "\n\nCart is empty"
-                else:
-                    # Set message text
-                    dialogue.reply_text = "🛒 <b>Your order is:</b>"
-                    # Show items in cart and sum subtotal price
-                    subtotal = 0
-                    k = 0
-                    for cart_item in dialogue.cart:
-                        k += 1
-                        item = ti.menu_items[cart_item['id']]['data']
-                        subtotal += item['attributes']['menu_price'] * cart_item['quantity']
-                        # Add items to the message text
-                        if cart_item['quantity'] == 1:
-                            dialogue.reply_text += f"\n\n<b>{k}. {item['attributes']['menu_name']}</b>\n"
-                            dialogue.reply_text += f"{ti.format_amount(item['attributes']['menu_price'], item['attributes']['currency'])}"
-                        else:
-                            dialogue.reply_text += f"\n\n<b>{k}. {item['attributes']['menu_name']}</b>\n"
-                            dialogue.reply_text += f"{ti.format_amount(item['attributes']['menu_price'], item['attributes']['currency'])} x {cart_item['quantity']}"
-                            
-                            items_price = item['attributes']['menu_price'] * cart_item['quantity']
-                            dialogue.reply_text += f" = {ti.format_amount(items_price, item['attributes']['currency'])}"
-                        # Add options to the message text
-                        if len(cart_item['options']) > 0:
-                            for option in cart_item['options']:
-                                if option is not None:
-                                    if option['price'] == 0:
-                                        dialogue.reply_text += f"\n{option['name']}"
-                                    else:
-                                        dialogue.reply_text += f"\n{option['name']} (+{ti.format_amount(option['price'], option['currency'])})"
-                                        subtotal += option['price'] * cart_item['quantity']
-
-                    total = subtotal
-                    discount = 0
-
-                    # Check delivery type
-                    if dialogue.user['order']['order_type'] == 'delivery':
-                        # Delivery fee
-                        # TODO: Add delivery fee calculation
-                        # delivery_fee = ti.get_delivery_fee(subtotal, location_id)
-                        # Temporary solution config delivery fee tmp-delivery-fee and tmp-delivery-free-limit - amount of order to get free delivery
-                        delivery_fee = config['tmp-delivery-fee']
-                        delivery_free_limit = config['tmp-delivery-free-limit']
-
-                        if subtotal >= delivery_free_limit:
-                            delivery_fee = 0
-                        
-                        if delivery_fee == 0:
-                            if delivery_free_limit > 0:
-                                dialogue.reply_text += f"\n\nDelivery fee: <s>{ti.format_amount(config['tmp-delivery-fee'], item['attributes']['currency'])}</s> {ti.format_amount(0, item['attributes']['currency'])}"
-                            else:
-                                dialogue.reply_text += f"\n\nDelivery fee: {ti.format_amount(0, item['attributes']['currency'])}"
-                        else:
-                            dialogue.reply_text += f"\n\nDelivery fee: {ti.format_amount(delivery_fee, item['attributes']['currency'])}"
-                            dialogue.reply_text += " (Free delivery for orders over " + ti.format_amount(config['tmp-delivery-free-limit'], item['attributes']['currency']) + ")"
-                            total += delivery_fee
-                    # Pickup
-                    elif dialogue.user['order']['order_type'] == 'collection':
-                        # Add pickup address to the message text
-                        dialogue.reply_text += f"\n\nPick up from: {ti.get_location_name(location_id)}"
-                        dialogue.reply_text += f"\nAddress: {ti.get_location_address(location_id)}"
-
-                    # Apply coupon            
-                    if dialogue.user['coupon'] != None:
-                        coupon = dialogue.user['coupon']
-                        # Check coupon type
-                        if coupon['attributes']['type'] == "F": # Fixed amount
-                            discount = float(coupon['attributes']['discount'])
-                            dialogue.reply_text += f"\n\n🎁 <code>{coupon['attributes']['code']}</code> (-{ti.format_amount(discount, config['ti-currency-code'])})"
-                            total -= discount
-                        elif coupon['attributes']['type'] == "P": # Percentage
-                            discount = subtotal * coupon['attributes']['discount'] / 100
-                            dialogue.reply_text += f"\n\n🎁 <code>{coupon['attributes']['code']}</code> (-{coupon['attributes']['discount']}%)"
-                            total -= discount
-        
-                    # If discount is greater than subtotal, set discount to subtotal
-                    if discount > subtotal:
-                        discount = subtotal
-        
-                    # If total is less than 0, set total to 0
-                    if total < 0:
-                        total = 0
-        
-                    # If discount > 0 add discount to message text
-                    if discount > 0:
-                        dialogue.reply_text += f"\n\nSubtotal: {ti.format_amount(subtotal, config['ti-currency-code'])}"
-                        dialogue.reply_text += f"\nDiscount: -{ti.format_amount(discount, config['ti-currency-code'])}"
-                        dialogue.reply_text += f"\n<b>Total: {ti.format_amount(total, config['ti-currency-code'])}</b>"
-                    else:
-                        dialogue.reply_text += f"\n\n<b>Total: {ti.format_amount(total, config['ti-currency-code'])}</b>"
-                    
-                    # Add select order_type button and checkout button
-                    dialogue.keyboard.append([
-                        InlineKeyboardButton(f"{config['ti-order-types'][dialogue.user['order']['order_type']]['emoji']} {dialogue.user['order']['order_type'].capitalize()}", callback_data="cart-0-order_type"),
-                        InlineKeyboardButton("✅ Checkout", callback_data="checkout"),
-                    ])
-                    # Create clear cart and edit cart buttons
-                    dialogue.keyboard.append([
-                        InlineKeyboardButton("🗑 Clear cart", callback_data="cart-0-clear"),
-                        InlineKeyboardButton("✏️ Edit cart", callback_data="cart-0-edit")]
-                    )
-                    # Create button for enter coupon code
-                    dialogue.keyboard.append([InlineKeyboardButton("🎁 Enter coupon code", callback_data="cart-0-coupon")])
-        
-                    # Print coupon code
-                    #if dialogue.coupon != None:
-                    #    dialogue.reply_text += f"\n\n<b>Coupon code</b> - {dialogue.coupon['code']}"
-            # Handle clear cart
-            elif action == "clear":
-                # Clear cart
-                dialogue.cart_clear()
-                # Set message text
-                dialogue.reply_text = "Cart cleared"
-            # Handle edit cart
-            elif action == "edit":
-                print("edit")
-                # Add text to reply
-                dialogue.reply_text += "\n\nPlease select an item to edit"
-                # Add items to reply text
-                for item_in_catrt in dialogue.cart:
-                    item = ti.menu_items[item_in_catrt['id']]['data']
-                    # Add edit buttons
-                    dialogue.keyboard.append([InlineKeyboardButton(f"{item['attributes']['menu_name']} x {item_in_catrt['quantity']} ✏️", callback_data=f"cart-{str(item_in_catrt['uid'])}-setquantity")])
-                    dialogue.keyboard.append([InlineKeyboardButton(f"{item['attributes']['menu_name']} x {item_in_catrt['quantity']} ❌ ", callback_data=f"cart-{str(item_in_catrt['uid'])}-remove")])
-                # Create back button to cart
-                dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
-            # Handle remove item from cart
-            elif action == "remove":
-                    # Remove item from cart
-                    dialogue.cart_remove(uid)
-                    # Set reply text
-                    dialogue.reply_text += "\n\nItem removed from cart"
-                    # Create back button to cart
-                    dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
-            # Handle set quantity for item in cart
-            elif action == "setquantity":
-                    # Ask user for quantity
-                    if params == None:
-                        # Add text to reply
-                        dialogue.reply_text += "\n\nHow many?"
-                
-                        # Add quantity buttons
-                        keyboard_row = []
-                        for i in range(1, 6):
-                            keyboard_row.append(InlineKeyboardButton(str(i), callback_data=f"cart-{str(uid)}-setquantity-{str(i)}"))
-                        dialogue.keyboard.append(keyboard_row)
-                
-                        # Create back button to cart
-                        dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
-                    else:
-                        # Set quantity for item in cart
-                        dialogue.cart_set_quantity(uid, int(params))
-                        # Set reply text
-                        dialogue.reply_text += f"\n\nQuantity set to {params}"
-                        # Create back button to cart
-                        dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
-            # Handle set options for item in cart
-            elif action == "setoption":
-                # Get item from cart
-                item_in_cart = dialogue.cart_get_item(uid)
-                # Get item
-                item_id = item_in_cart['id']
-                item = ti.menu_items[item_id]['data']
-                # Get options
-                available_item_options = ti.get_item_options(item_id)
-                # Get option valie id
-                option_value = int(params)
-                
-                # As temp solution, we only support one option
-                option = available_item_options[0]
-                
-                # Find option in cart item
-                selected_option = None
-                for attribute in option['attributes']:
-                    if attribute == 'menu_option_values':
-                        menu_option_values = option['attributes']['menu_option_values']
-                        for menu_option_value in menu_option_values:
-                            if int(menu_option_value['menu_option_value_id']) == option_value:
-                                # Set selected option
-                                selected_option = menu_option_value
-                                break
-    
-                dialogue.cart_set_option(uid, selected_option)
-    
-                # Set reply text
-                dialogue.reply_text += f"\n\nOption set to {selected_option['name']}"
-    
-                # Create button the item in the menu item-{item_id}
-                dialogue.keyboard.append([InlineKeyboardButton(f"⬅️ Back to {item['attributes']['menu_name']}", callback_data=f"item-{item_id}")])
-            # Handle order_type type selection. Set dialogue.user['order']['order_type'] = "delivery" | "collection"
-            elif action == "order_type":
-                if params == None:
-                    dialogue.reply_text += "\n\nWill you pick up the order yourself or choose delivery?"
-                    dialogue.reply_text += f"\n\nRestaurant: {ti.get_location_name(location_id)}"
-                    dialogue.reply_text += f"\nAddress: {ti.get_location_address(location_id)}"
-                    
-                    location_statuses = ti.get_location_statuses(location_id)
-                    
-                    dialogue.reply_text += "\n"
-                    if location_statuses['delivery']['status']:
-                        dialogue.reply_text += f"\n✅ Delivery until {location_statuses['delivery']['ends']}"
-                    else:
-                        dialogue.reply_text += f"\n⏸ Delivery will open at {location_statuses['delivery']['starts']}"
-                    
-                    if location_statuses['pickup']['status']:
-                        dialogue.reply_text += f"\n✅ Pickup until {location_statuses['pickup']['ends']}"
-                    else:
-                        dialogue.reply_text += f"\n⏸ Pickup will open at {location_statuses['pickup']['starts']}"
-                    
-                    # Add order type buttons
-                    for delivery_type in config['ti-order-types']:
-                        dialogue.keyboard.append([InlineKeyboardButton(f"{config['ti-order-types'][delivery_type]['emoji']} {delivery_type.capitalize()}", callback_data=f"cart-0-order_type-{delivery_type}")])
-                        
-                    # Create back button to cart
-                    dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
-                elif params in config['ti-order-types']:
-                    # Set order type
-                    dialogue.set_order_type(params)
-                    # Set reply text
-                    dialogue.reply_text += f"\n\nOrder type set to {params}"
-                    # Create button to cart
-                    dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back to cart", callback_data="cart")])
-                else:
-                    logger.error(f"Invalid order type: {params}")
-                    # Set reply text
-                    dialogue.reply_text += f"\n\nInvalid order type"
-                    # Create button to cart
-                    dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back to cart", callback_data="cart")])
-            # Coupon code handling
-            elif action == "coupon":
-                # Wait for coupon code
-                dialogue.update_nav('text_requested_for', 'coupon_code')
-                dialogue.update_nav('after_request_screen', 'cart')
-    
-                # Add text to reply
-                dialogue.reply_text += "\n\nPlease send me a coupon code"
-                
-                # Disable home and cart buttons
-                dialogue.home_button = False
-                dialogue.cart_button = False
-        
-        # Handle checkout
-        elif query.data.startswith("checkout"):
-                dialogue.reply_text += "<b>Checkout</b>"
-                order = dialogue.user['order']
-                ready_to_checkout = True
-                
-                if dialogue.cart_count() == 0:
-                    ready_to_checkout = False
-                    dialogue.reply_text += "\n\nYour cart is empty. Please add some items to cart"
-                    # Create button to home screen
-                elif order['order_type'] == 'delivery' and order['delivery_address'] == None:
-                    ready_to_checkout = False
-                    dialogue.reply_text += "\n\nWe need your delivery address to complete the order"
-                    # Add button to set delivery address
-                    dialogue.keyboard.append([InlineKeyboardButton("📍 Set delivery address", callback_data=f"cart-0-delivery_address")])
-                    
-                # Check if all is good to checkout
-                if ready_to_checkout:
-                    # Liast all checkout parameters and their values
-                    dialogue.reply_text += "\n\n<b>Order details</b>"
-                    if order['order_type'] == 'delivery':
-                        dialogue.reply_text += f"🚚 Your order will be delivered to: <b>{order['delivery_address']}</b>\n"
-                    elif order['order_type'] == 'collection':
-                        # Add pickup address to the message text
-                        dialogue.reply_text += f"\n\nPick up from: {ti.get_location_name(location_id)}"
-                        dialogue.reply_text += f"\nAddress: {ti.get_location_address(location_id)}"
-                      
-                    # Payment method
-                    # Temporarily solution to handle empty payments array (options.payments) returned by API.
-                    
-                    # Add payment method to the message text
-                    payment_method = config['ti-payment-methods'][order['payment_method']]
-                    dialogue.reply_text += f"\n\n💵 Payment method: <b>{payment_method['name']}</b>"
-                    
-                    
-                    
-                    # dialogue.reply_text += f"\n\n💵 Payment method: <b>{order['payment_method']}</b>"
-                    
-                    
-                    # Check if in cart are items that couldn't be delivered
-                    # undeliverable_items = dialogue.cart_get_undeliverable_items()
-                    
-                    # Add button to change delivery method
-                    dialogue.keyboard.append([InlineKeyboardButton("Change delivery method", callback_data=f"checkout-deliverymethod")])
-                    
-                    # Add button to change payment method
-                    dialogue.keyboard.append([InlineKeyboardButton("Change payment method", callback_data=f"checkout-paymentmethod")])
-                
-                    
-                # Check if user did not enter phone number
-                '''elif dialogue.user['phone'] == None:
-                    # Request user to enter phone number
-                    dialogue.reply_text = "Please send us your phone number"
-                    dialogue.reply_text += "\n\nYou can enter your phone number or send it to me by pressing the button below."
-                    dialogue.reply_text += "\n\nWe need your phone number <b>only</b> to contact you in case of any issues with your order."
-                    
-                    dialogue.update_nav('text_requested_for', 'phone')
-                    dialogue.update_nav('after_request_screen', 'cart')
-                    
-                    keyboard=ReplyKeyboardMarkup([
-                        [KeyboardButton("Send phone number", request_contact=True)],
-                        [KeyboardButton("❌ Cancel")] # ❌ is a sign to go after_request_screen
-                    ])
-                    await query.message.reply_text(dialogue.reply_text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-                    return
-                    '''
-                
-        
-        # Handle location reset request and confirmation
-        elif query.data.startswith("resetlocation-"):
-            # Get step from button data
-            step = str(query.data.split("-")[1])
-            
-            # Handle request
-            if step == "request":
-                # If cart is not empty, add warning to message text
-                if dialogue.cart_count() > 0:
-                    dialogue.reply_text = "Your cart will be cleared"
-                    # Create confirm button
-                    dialogue.keyboard.append([InlineKeyboardButton("Ok", callback_data="resetlocation-confirm")])
-                    # Create cancel button
-                    dialogue.keyboard.append([InlineKeyboardButton("Cancel", callback_data="location-"+str(dialogue.nav['current_location']))])
-                else:
-                    step = "confirm"
-                    
-            if step == "confirm":
-                # Clear cart
-                dialogue.cart_clear()
-                # Reset navigation
-                dialogue.nav_reset()
-
-                # Disable home button
-                dialogue.home_button = False 
-
-                # Offer to select location
-                dialogue.reply_text += "\n\n" + "Please select a Restaurant:"
-                for location in ti.active_locations:
-                    dialogue.keyboard.append([InlineKeyboardButton(location['attributes']['location_name'], callback_data="location-"+str(location['id']))])
-    
-        # Handle Admin commands
-        elif query.data.startswith("admin-"):
-            action = str(query.data.split("-")[1])
-            
-            # Reload data from API
-            if action == "reload":
-                ti.clear_cache()
-                ti.load()
-                dialogue.reply_text += "\n\nCache is cleared, data is reloaded"
-                
-            # Create back button
-            dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="location-"+str(dialogue.nav['current_location']))])    
+        # Parse button data once and call the handler registered for its prefix
+        callback = router.parse(query.data)
+        if callback is None:
+            logger.warning(f"User {dialogue.user_id} pressed unknown button {query.data}")
+        elif await router.dispatch(callback, dialogue, location_id, context) is False:
+            # Handler has nothing to reply
+            return
 
         # Update the message from which the query originated
         # KEYBOARD MANAGEMENT #
         # Reset location button
-        if not query.data.startswith("resetlocation") and len(ti.active_locations) > 1:
+        route = callback.route if callback is not None else None
+        if route != "resetlocation" and len(ti.active_locations) > 1:
             # If it is home section, add reset location button
-            if query.data.startswith("location-"):
+            if route == "location":
                 dialogue.nav_buttons.append([InlineKeyboardButton("📍", callback_data="resetlocation-request")])
     
         # Home and cart buttons management     
-        if query.data.startswith("cart-0-coupon"): dialogue.home_button = False
-        elif query.data.startswith("location-"): dialogue.home_button = False
+        if route == "cart" and callback.id == "0" and callback.action == "coupon": dialogue.home_button = False
+        elif route == "location": dialogue.home_button = False
 
     if dialogue.cart_button and dialogue.cart_count():
         dialogue.nav_buttons.append([InlineKeyboardButton(f"🛒 Cart ({dialogue.cart_count()})", callback_data="cart")])
@@ -701,7 +108,9 @@ async def process_usser_action(update: Update, context: ContextTypes.DEFAULT_TYP
     if dialogue.image is not None:
         dialogue.reply_text = dialogue.reply_text + f" <a href=\"{dialogue.image}\">.</a>"
     
-    dialogue.reply_text = dialogue.filter_text(dialogue.reply_text)
+    # Cached screens are filtered when they are rendered
+    if not dialogue.text_filtered:
+        dialogue.reply_text = dialogue.filter_text(dialogue.reply_text)
 
     # Send the message or edit the existing one
     if dialogue.existed_message:
@@ -730,6 +139,614 @@ async def process_usser_action(update: Update, context: ContextTypes.DEFAULT_TYP
 
     await dialogue.keep_one_message()
 
+@router.route("location", int)
+async def show_location(callback: Callback, dialogue: Dialogue, location_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool | None:
+    '''Location screen: description, opening statuses and categories.'''
+    location_id = callback.id
+    dialogue.home_button = False
+
+
+    # Check if location is active
+    if not ti.is_active_location(location_id):
+        logger.warning(f"User {dialogue.user_id} tried to select inactive location {location_id}")
+        return False
+
+    # Save current location ID to dialogue
+    dialogue.update_nav('current_location', location_id)
+
+    # Parse location info page if it is not cached yet, statuses below need its schedule
+    await ti.get_location_info(location_id)
+
+    # Location name, description and categories are the same for all users
+    is_admin = dialogue.user_id in config['admins']
+    screen = render_cache.get('location', location_id, None, ti.catalog.version, is_admin, lambda: render_location(location_id, is_admin))
+    dialogue.reply_text += screen.text
+
+    location_statuses = ti.get_location_statuses(location_id)
+
+    if location_statuses['delivery']['status']:
+        dialogue.reply_text += f"\n✅ Delivery until {location_statuses['delivery']['ends']}"
+    else:
+        dialogue.reply_text += f"\n⏸ Delivery will open at {location_statuses['delivery']['starts']}"
+
+    if location_statuses['pickup']['status']:
+        dialogue.reply_text += f"\n✅ Pickup until {location_statuses['pickup']['ends']}"
+    else:
+        dialogue.reply_text += f"\n⏸ Pickup will open at {location_statuses['pickup']['starts']}"
+
+    dialogue.reply_text += screen.footer
+    dialogue.keyboard += screen.keyboard
+    dialogue.text_filtered = True
+
+    # Admin buttons
+    if dialogue.is_admin:
+        # Reload button
+        dialogue.nav_buttons.append([InlineKeyboardButton("🔄 Reload", callback_data="admin-reload")])
+
+@router.route("category", int)
+async def show_category(callback: Callback, dialogue: Dialogue, location_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool | None:
+    '''Category screen: menu items of the category.'''
+    category_id = callback.id
+
+    # Save current category ID to dialogue
+    dialogue.update_nav('current_category', category_id)
+
+    # Category screen is the same for all users
+    screen = render_cache.get('category', location_id, category_id, ti.catalog.version, False, lambda: render_category(location_id, category_id))
+    dialogue.reply_text += screen.text
+    dialogue.keyboard += screen.keyboard
+    dialogue.text_filtered = True
+
+@router.route("item", int)
+async def show_item(callback: Callback, dialogue: Dialogue, location_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool | None:
+    '''Menu item screen and adding the item to cart. Format "item-{id}-{action}-{params}"'''
+    # Item ID, action and parameters from button data
+    item_id, action, params = callback.id, callback.action, callback.params
+
+    # Get item data
+    item = ti.menu_items[item_id]['data']
+
+    category_id = dialogue.nav['current_category']
+    menu = ti.menus[location_id]
+
+    # Show item main screen
+    if action == None:  
+        # Add item name to reply text
+        dialogue.reply_text = f"<b>{item['attributes']['menu_name']}</b>"
+
+        # Count items with the same ID in cart and add to reply text
+        current_item_quantity = dialogue.cart.quantity(item_id)
+
+        # Add item quantity to reply text
+        if current_item_quantity > 0:
+            dialogue.reply_text += f" (in a cart: {current_item_quantity})"
+
+        # Add item description to reply text
+        dialogue.reply_text += f"\n\n{item['attributes']['menu_description']}"
+
+        # Add item price to reply text
+        dialogue.reply_text += "\n\n" + f"Price: {ti.format_amount(item['attributes']['menu_price'], item['attributes']['currency'])} {item['attributes']['currency']}"
+
+        # Check is there image for this item
+        if 'included' in ti.menu_items[item_id]:
+            for attachment in ti.menu_items[item_id]['included']:
+                if attachment['type'] == 'media':
+                    dialogue.image = attachment['attributes']['path']
+
+        # Create add to cart button
+        dialogue.keyboard.append([InlineKeyboardButton("🛒 Add to cart", callback_data=f"item-{str(item_id)}-addtocart")])
+        # Handle item navigation
+        keyboard_row = []
+        # Create back button to category
+        keyboard_row.append(InlineKeyboardButton("⬅️ Back", callback_data="category-"+str(dialogue.nav['current_category'])))
+
+        # If there are more than one item in this menu category build navigation buttons
+        if len(menu[category_id]) > 1:
+            # Find current item index in menu[category_id]
+            current_item_index = ti.menu_positions[location_id][category_id][item_id]
+
+            # Add to reply text N of M
+            dialogue.reply_text += f"\n\n{current_item_index+1} of {len(menu[category_id])}"
+
+            # Find previous item id in menu[category_id] if current item is not the first one
+            if current_item_index > 0:
+                previous_item_id = menu[category_id][current_item_index-1]
+                keyboard_row.append(InlineKeyboardButton("<<<", callback_data="item-"+str(previous_item_id)))
+
+            # Find next item id in menu[category_id] if current item is not the last one
+            if current_item_index < len(menu[category_id])-1:
+                next_item_id = menu[category_id][current_item_index+1]
+                keyboard_row.append(InlineKeyboardButton(">>>", callback_data="item-"+str(next_item_id)))
+
+        # Add keyboard row to keyboard
+        if len(keyboard_row) > 0:
+            dialogue.keyboard.append(keyboard_row)
+
+    # Handling Add to Cart
+    elif action == "addtocart":
+        # Ask the user for a quantity
+        if params == None:
+            # Add text to reply
+            dialogue.reply_text += "\n\nHow many?"
+
+            # Add quantity buttons.
+            keyboard_row = []
+            for i in range(1, 6):
+                keyboard_row.append(InlineKeyboardButton(str(i), callback_data=f"item-{str(item_id)}-addtocart-{str(i)}"))
+                if i % 3 == 0:
+                    dialogue.keyboard.append(keyboard_row)
+                    keyboard_row = []
+            # Add last row if it is not full
+            if len(keyboard_row) > 0:
+                dialogue.keyboard.append(keyboard_row)
+
+            # Create back button to item
+            dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="item-"+str(item_id))])
+
+        # Add an item to cart and ask for options if there are any
+        # Check if quantity is valid
+        elif int(params) > 0 and int(params) <= config['max-quantity']:
+            # Get quantity from params
+            quantity = int(params)    
+
+            # Check quantity is in reasonable range
+            if quantity < 1 or quantity > config['max-quantity']:
+                quantity = 1
+                logging.warning(f"Quantity {quantity} is out of range (1-{config['max-quantity']})")
+
+            # Add item to the cart and get its uid
+            uid = dialogue.cart_append(item_id, quantity)
+            dialogue.cart_button = True
+
+            # Add text to reply
+            dialogue.reply_text += f"{quantity} x {item['attributes']['menu_name']} added to your cart ✅"
+
+            available_item_options = ti.get_item_options(item_id)
+            # Ask user for an option if there are any                
+            if len(available_item_options) > 0:
+                dialogue.nav['current_menu_item_options'] = available_item_options[0]
+                option = available_item_options[0] # Get first option. This is a temporary solution.
+
+                # Check if there are unselected options
+                if len(available_item_options) > dialogue.cart_options_count(uid):
+                    # Ask user for an option
+                    dialogue.reply_text = f"Please select an option."
+
+                    # Add option name to
+                    dialogue.reply_text += f"\n\n<b>{option['attributes']['option_name']}</b>"
+
+                    # Add buttons for each option value
+                    default_option_value_id = None
+                    for option_value in option['attributes']['menu_option_values']:
+                        # Check if this option is default
+                        if option_value['is_default']:
+                            default_option_value_id = option_value['menu_option_value_id']
+
+                        # Add option button
+                        dialogue.keyboard.append([InlineKeyboardButton(f"{option_value['name']} (+{ti.format_amount(option_value['price'], item['attributes']['currency'])})", callback_data=f"cart-{str(uid)}-setoption-{str(option_value['menu_option_value_id'])}")])
+
+                    # Add Skip button if option is not required and default option value is set
+                    if not option['attributes']['required']:
+                        dialogue.keyboard.append([InlineKeyboardButton(f"Skip", callback_data=f"cart-{str(uid)}-setoption-{str(default_option_value_id)}")])
+
+                    # Disable home and cart buttons
+                    dialogue.home_button = False
+                    dialogue.cart_button = False
+
+                # There are no unselected options
+                else:
+                    dialogue.cart_button = True
+                    print("!!!!")
+
+            # Create back to the item button
+            dialogue.keyboard.append([InlineKeyboardButton(f"⬅️ {item['attributes']['menu_name']}", callback_data=f"item-{str(item_id)}")])
+
+            # Create cancel button leadeing to remove item from cart
+            dialogue.keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data="cart-"+str(uid)+"-remove")])
+        else:
+            # Set reply text
+            dialogue.reply_text = "Invalid quantity"
+            # Create back button to item
+            dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="item-"+str(item_id))])
+
+@router.route("cart")
+async def show_cart(callback: Callback, dialogue: Dialogue, location_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool | None:
+    '''Cart screen and cart actions. Format: "cart-{uid}-{action}-{params}"'''
+    # Line uid, action and parameters from button data
+    uid, action, params = callback.id, callback.action, callback.params
+
+    dialogue.cart_button = False
+
+    # Handle cart
+    if action == None:
+        # Check if cart is empty
+        if dialogue.cart_count() == 0:
+            dialogue.reply_text += "\n\nCart is empty"
+        else:
+            # Set message text
+            dialogue.reply_text = "🛒 <b>Your order is:</b>"
+            # Quote is cached until the cart, the catalog, the order type or the coupon change
+            quote = pricing.quote(dialogue.cart, ti.catalog, dialogue.user['order']['order_type'], dialogue.user['coupon'])
+            # Show items in cart
+            for k, line in enumerate(quote.lines, start=1):
+                # Add items to the message text
+                dialogue.reply_text += f"\n\n<b>{k}. {line.name}</b>\n"
+                if line.quantity == 1:
+                    dialogue.reply_text += f"{ti.format_amount(line.unit_price, line.currency)}"
+                else:
+                    dialogue.reply_text += f"{ti.format_amount(line.unit_price, line.currency)} x {line.quantity}"
+                    dialogue.reply_text += f" = {ti.format_amount(line.total, line.currency)}"
+                # Add options to the message text
+                for option in line.options:
+                    if option['price'] == 0:
+                        dialogue.reply_text += f"\n{option['name']}"
+                    else:
+                        dialogue.reply_text += f"\n{option['name']} (+{ti.format_amount(option['price'], option['currency'])})"
+
+            # Check delivery type
+            if quote.delivery_fee is not None:
+                # Delivery fee
+                # TODO: Add delivery fee calculation
+                # Temporary solution config delivery fee tmp-delivery-fee and tmp-delivery-free-limit - amount of order to get free delivery
+                if quote.delivery_fee == 0:
+                    if quote.free_delivery_limit > 0:
+                        dialogue.reply_text += f"\n\nDelivery fee: <s>{ti.format_amount(quote.base_delivery_fee, quote.currency)}</s> {ti.format_amount(0, quote.currency)}"
+                    else:
+                        dialogue.reply_text += f"\n\nDelivery fee: {ti.format_amount(0, quote.currency)}"
+                else:
+                    dialogue.reply_text += f"\n\nDelivery fee: {ti.format_amount(quote.delivery_fee, quote.currency)}"
+                    dialogue.reply_text += " (Free delivery for orders over " + ti.format_amount(quote.free_delivery_limit, quote.currency) + ")"
+            # Pickup
+            elif dialogue.user['order']['order_type'] == 'collection':
+                # Add pickup address to the message text
+                dialogue.reply_text += f"\n\nPick up from: {ti.get_location_name(location_id)}"
+                dialogue.reply_text += f"\nAddress: {ti.get_location_address(location_id)}"
+
+            # Applied coupon
+            if quote.coupon is not None:
+                coupon = quote.coupon
+                if coupon['attributes']['type'] == "F": # Fixed amount
+                    dialogue.reply_text += f"\n\n🎁 <code>{coupon['attributes']['code']}</code> (-{ti.format_amount(float(coupon['attributes']['discount']), config['ti-currency-code'])})"
+                elif coupon['attributes']['type'] == "P": # Percentage
+                    dialogue.reply_text += f"\n\n🎁 <code>{coupon['attributes']['code']}</code> (-{coupon['attributes']['discount']}%)"
+
+            # If discount > 0 add discount to message text
+            if quote.discount > 0:
+                dialogue.reply_text += f"\n\nSubtotal: {ti.format_amount(quote.subtotal, config['ti-currency-code'])}"
+                dialogue.reply_text += f"\nDiscount: -{ti.format_amount(quote.discount, config['ti-currency-code'])}"
+                dialogue.reply_text += f"\n<b>Total: {ti.format_amount(quote.total, config['ti-currency-code'])}</b>"
+            else:
+                dialogue.reply_text += f"\n\n<b>Total: {ti.format_amount(quote.total, config['ti-currency-code'])}</b>"
+
+            # Add select order_type button and checkout button
+            dialogue.keyboard.append([
+                InlineKeyboardButton(f"{config['ti-order-types'][dialogue.user['order']['order_type']]['emoji']} {dialogue.user['order']['order_type'].capitalize()}", callback_data="cart-0-order_type"),
+                InlineKeyboardButton("✅ Checkout", callback_data="checkout"),
+            ])
+            # Create clear cart and edit cart buttons
+            dialogue.keyboard.append([
+                InlineKeyboardButton("🗑 Clear cart", callback_data="cart-0-clear"),
+                InlineKeyboardButton("✏️ Edit cart", callback_data="cart-0-edit")]
+            )
+            # Create button for enter coupon code
+            dialogue.keyboard.append([InlineKeyboardButton("🎁 Enter coupon code", callback_data="cart-0-coupon")])
+
+            # Print coupon code
+            #if dialogue.coupon != None:
+            #    dialogue.reply_text += f"\n\n<b>Coupon code</b> - {dialogue.coupon['code']}"
+    # Handle clear cart
+    elif action == "clear":
+        # Clear cart
+        dialogue.cart_clear()
+        # Set message text
+        dialogue.reply_text = "Cart cleared"
+    # Handle edit cart
+    elif action == "edit":
+        print("edit")
+        # Add text to reply
+        dialogue.reply_text += "\n\nPlease select an item to edit"
+        # Add items to reply text, names come with the cached cart quote
+        quote = pricing.quote(dialogue.cart, ti.catalog, dialogue.user['order']['order_type'], dialogue.user['coupon'])
+        for line in quote.lines:
+            # Add edit buttons
+            dialogue.keyboard.append([InlineKeyboardButton(f"{line.name} x {line.quantity} ✏️", callback_data=f"cart-{str(line.uid)}-setquantity")])
+            dialogue.keyboard.append([InlineKeyboardButton(f"{line.name} x {line.quantity} ❌ ", callback_data=f"cart-{str(line.uid)}-remove")])
+        # Create back button to cart
+        dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
+    # Handle remove item from cart
+    elif action == "remove":
+            # Remove item from cart
+            dialogue.cart_remove(uid)
+            # Set reply text
+            dialogue.reply_text += "\n\nItem removed from cart"
+            # Create back button to cart
+            dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
+    # Handle set quantity for item in cart
+    elif action == "setquantity":
+            # Ask user for quantity
+            if params == None:
+                # Add text to reply
+                dialogue.reply_text += "\n\nHow many?"
+
+                # Add quantity buttons
+                keyboard_row = []
+                for i in range(1, 6):
+                    keyboard_row.append(InlineKeyboardButton(str(i), callback_data=f"cart-{str(uid)}-setquantity-{str(i)}"))
+                dialogue.keyboard.append(keyboard_row)
+
+                # Create back button to cart
+                dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
+            else:
+                # Set quantity for item in cart
+                dialogue.cart_set_quantity(uid, int(params))
+                # Set reply text
+                dialogue.reply_text += f"\n\nQuantity set to {params}"
+                # Create back button to cart
+                dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
+    # Handle set options for item in cart
+    elif action == "setoption":
+        # Get item from cart
+        item_in_cart = dialogue.cart_get_item(uid)
+        # Get item
+        item_id = item_in_cart['id']
+        item = ti.menu_items[item_id]['data']
+        # Get options
+        available_item_options = ti.get_item_options(item_id)
+        # Get option valie id
+        option_value = int(params)
+
+        # As temp solution, we only support one option
+        option = available_item_options[0]
+
+        # Find option in cart item
+        selected_option = None
+        for attribute in option['attributes']:
+            if attribute == 'menu_option_values':
+                menu_option_values = option['attributes']['menu_option_values']
+                for menu_option_value in menu_option_values:
+                    if int(menu_option_value['menu_option_value_id']) == option_value:
+                        # Set selected option
+                        selected_option = menu_option_value
+                        break
+
+        dialogue.cart_set_option(uid, selected_option)
+
+        # Set reply text
+        dialogue.reply_text += f"\n\nOption set to {selected_option['name']}"
+
+        # Create button the item in the menu item-{item_id}
+        dialogue.keyboard.append([InlineKeyboardButton(f"⬅️ Back to {item['attributes']['menu_name']}", callback_data=f"item-{item_id}")])
+    # Handle order_type type selection. Set dialogue.user['order']['order_type'] = "delivery" | "collection"
+    elif action == "order_type":
+        if params == None:
+            dialogue.reply_text += "\n\nWill you pick up the order yourself or choose delivery?"
+            dialogue.reply_text += f"\n\nRestaurant: {ti.get_location_name(location_id)}"
+            dialogue.reply_text += f"\nAddress: {ti.get_location_address(location_id)}"
+
+            location_statuses = ti.get_location_statuses(location_id)
+
+            dialogue.reply_text += "\n"
+            if location_statuses['delivery']['status']:
+                dialogue.reply_text += f"\n✅ Delivery until {location_statuses['delivery']['ends']}"
+            else:
+                dialogue.reply_text += f"\n⏸ Delivery will open at {location_statuses['delivery']['starts']}"
+
+            if location_statuses['pickup']['status']:
+                dialogue.reply_text += f"\n✅ Pickup until {location_statuses['pickup']['ends']}"
+            else:
+                dialogue.reply_text += f"\n⏸ Pickup will open at {location_statuses['pickup']['starts']}"
+
+            # Add order type buttons
+            for delivery_type in config['ti-order-types']:
+                dialogue.keyboard.append([InlineKeyboardButton(f"{config['ti-order-types'][delivery_type]['emoji']} {delivery_type.capitalize()}", callback_data=f"cart-0-order_type-{delivery_type}")])
+
+            # Create back button to cart
+            dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="cart")])
+        elif params in config['ti-order-types']:
+            # Set order type
+            dialogue.set_order_type(params)
+            # Set reply text
+            dialogue.reply_text += f"\n\nOrder type set to {params}"
+            # Create button to cart
+            dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back to cart", callback_data="cart")])
+        else:
+            logger.error(f"Invalid order type: {params}")
+            # Set reply text
+            dialogue.reply_text += f"\n\nInvalid order type"
+            # Create button to cart
+            dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back to cart", callback_data="cart")])
+    # Coupon code handling
+    elif action == "coupon":
+        # Wait for coupon code
+        dialogue.update_nav('text_requested_for', 'coupon_code')
+        dialogue.update_nav('after_request_screen', 'cart')
+
+        # Add text to reply
+        dialogue.reply_text += "\n\nPlease send me a coupon code"
+
+        # Disable home and cart buttons
+        dialogue.home_button = False
+        dialogue.cart_button = False
+
+@router.route("checkout")
+async def show_checkout(callback: Callback, dialogue: Dialogue, location_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool | None:
+    '''Checkout screen.'''
+    dialogue.reply_text += "<b>Checkout</b>"
+    order = dialogue.user['order']
+    ready_to_checkout = True
+
+    if dialogue.cart_count() == 0:
+        ready_to_checkout = False
+        dialogue.reply_text += "\n\nYour cart is empty. Please add some items to cart"
+        # Create button to home screen
+    elif order['order_type'] == 'delivery' and order['delivery_address'] == None:
+        ready_to_checkout = False
+        dialogue.reply_text += "\n\nWe need your delivery address to complete the order"
+        # Add button to set delivery address
+        dialogue.keyboard.append([InlineKeyboardButton("📍 Set delivery address", callback_data=f"cart-0-delivery_address")])
+
+    # Check if all is good to checkout
+    if ready_to_checkout:
+        # Liast all checkout parameters and their values
+        dialogue.reply_text += "\n\n<b>Order details</b>"
+        if order['order_type'] == 'delivery':
+            dialogue.reply_text += f"🚚 Your order will be delivered to: <b>{order['delivery_address']}</b>\n"
+        elif order['order_type'] == 'collection':
+            # Add pickup address to the message text
+            dialogue.reply_text += f"\n\nPick up from: {ti.get_location_name(location_id)}"
+            dialogue.reply_text += f"\nAddress: {ti.get_location_address(location_id)}"
+
+        # Payment method
+        # Temporarily solution to handle empty payments array (options.payments) returned by API.
+
+        # Add payment method to the message text
+        payment_method = config['ti-payment-methods'][order['payment_method']]
+        dialogue.reply_text += f"\n\n💵 Payment method: <b>{payment_method['name']}</b>"
+
+        # Order total, usually the quote is already cached by the cart screen
+        quote = pricing.quote(dialogue.cart, ti.catalog, order['order_type'], dialogue.user['coupon'])
+        dialogue.reply_text += f"\n\n<b>Total: {ti.format_amount(quote.total, config['ti-currency-code'])}</b>"
+
+
+
+        # dialogue.reply_text += f"\n\n💵 Payment method: <b>{order['payment_method']}</b>"
+
+
+        # Check if in cart are items that couldn't be delivered
+        # undeliverable_items = dialogue.cart_get_undeliverable_items()
+
+        # Add button to change delivery method
+        dialogue.keyboard.append([InlineKeyboardButton("Change delivery method", callback_data=f"checkout-deliverymethod")])
+
+        # Add button to change payment method
+        dialogue.keyboard.append([InlineKeyboardButton("Change payment method", callback_data=f"checkout-paymentmethod")])
+
+
+    # Check if user did not enter phone number
+    '''elif dialogue.user['phone'] == None:
+        # Request user to enter phone number
+        dialogue.reply_text = "Please send us your phone number"
+        dialogue.reply_text += "\n\nYou can enter your phone number or send it to me by pressing the button below."
+        dialogue.reply_text += "\n\nWe need your phone number <b>only</b> to contact you in case of any issues with your order."
+
+        dialogue.update_nav('text_requested_for', 'phone')
+        dialogue.update_nav('after_request_screen', 'cart')
+
+        keyboard=ReplyKeyboardMarkup([
+            [KeyboardButton("Send phone number", request_contact=True)],
+            [KeyboardButton("❌ Cancel")] # ❌ is a sign to go after_request_screen
+        ])
+        await query.message.reply_text(dialogue.reply_text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+        return
+        '''
+
+@router.route("resetlocation")
+async def reset_location(callback: Callback, dialogue: Dialogue, location_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool | None:
+    '''Location reset request and confirmation. Format: "resetlocation-{step}"'''
+    # Get step from button data
+    step = callback.id
+
+    # Handle request
+    if step == "request":
+        # If cart is not empty, add warning to message text
+        if dialogue.cart_count() > 0:
+            dialogue.reply_text = "Your cart will be cleared"
+            # Create confirm button
+            dialogue.keyboard.append([InlineKeyboardButton("Ok", callback_data="resetlocation-confirm")])
+            # Create cancel button
+            dialogue.keyboard.append([InlineKeyboardButton("Cancel", callback_data="location-"+str(dialogue.nav['current_location']))])
+        else:
+            step = "confirm"
+
+    if step == "confirm":
+        # Clear cart
+        dialogue.cart_clear()
+        # Reset navigation
+        dialogue.nav_reset()
+
+        # Disable home button
+        dialogue.home_button = False 
+
+        # Offer to select location
+        dialogue.reply_text += "\n\n" + "Please select a Restaurant:"
+        for location in ti.active_locations:
+            dialogue.keyboard.append([InlineKeyboardButton(location['attributes']['location_name'], callback_data="location-"+str(location['id']))])
+
+@router.route("admin")
+async def admin_command(callback: Callback, dialogue: Dialogue, location_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool | None:
+    '''Admin commands. Format: "admin-{action}"'''
+    action = callback.id
+
+    # Reload data from API
+    if action == "reload":
+        # Build a new catalog in background. Users keep browsing the current one until it is swapped
+        if catalog_snapshot is not None:
+            # Workers of supervisor.py get the catalog from the supervisor, ask it to reload
+            os.kill(os.getppid(), signal.SIGUSR1)
+        else:
+            context.application.create_task(ti.refresh())
+        dialogue.reply_text += "\n\nData is reloading in background, changes will be logged"
+
+    # Create back button
+    dialogue.keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="location-"+str(dialogue.nav['current_location']))])    
+
+def render_location(location_id: int, is_admin: bool) -> Screen:
+    '''Location screen: name and description go before the location statuses, categories after them.'''
+    location = ti.get_location_display(location_id)
+    menu = ti.menus[location_id]
+
+    # Add location name to reply text
+    text = f"📍<b>{location['name']}</b>"
+    
+    # If user is admin, add admin tag
+    if is_admin:
+        text += f" [admin]"
+    
+    # Add location description to reply text
+    text += f"\n{location['description']}"
+    text += "\n"
+
+    # Offer to select a category 
+    keyboard = []
+    for category_id in menu:
+        category = ti.categories[category_id]
+        # Add categories to keyboard
+        keyboard.append([InlineKeyboardButton(category['attributes']['name'], callback_data="category-"+str(category_id))])
+
+    if len(keyboard) > 0:
+        footer = "\n\n" + "Please select a category"
+    else:
+        footer = "\n\n" + "There are no categories for this location"
+
+    return Screen(Dialogue.filter_text(text), keyboard, footer)
+
+def render_category(location_id: int, category_id: int) -> Screen:
+    '''Category screen: menu items with prices.'''
+    menu = ti.menus[location_id]
+
+    # Add category name to reply text
+    text = f"<b>{ti.categories[category_id]['attributes']['name']}</b>"
+
+    # Offer to select an item
+    keyboard = []
+    for item_id in menu[category_id]:
+        item = ti.menu_items[item_id]
+        # Format price with spaces after every 3 digits from the end
+        price = ti.format_amount(item['data']['attributes']['menu_price'], item['data']['attributes']['currency'])
+        
+        # Add items to keyboard
+        keyboard.append([InlineKeyboardButton(f"{item['data']['attributes']['menu_name']} {price}", callback_data="item-"+str(item_id))])
+    
+    if len(keyboard) > 0:
+        text += "\n\n" + "Please select an item"
+    else:
+        text += "\n\n" + "There are no items in this category"
+
+    # Create back button to location
+    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="location-"+str(location_id))])
+
+    return Screen(Dialogue.filter_text(text), keyboard)
+
 async def msg(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     '''Handle any message that is not a command'''
     query = update.message
@@ -756,7 +773,10 @@ async def msg(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         # Handle coupone code
         if dialogue.nav['text_requested_for'] == 'coupon_code':
             coupon = ti.get_coupon(text)
-            if coupon is not None:
+            # Coupon may be limited to locations and menu items
+            if coupon is not None and not ti.catalog.coupon_applies(coupon, dialogue.nav_get_current_location(), dialogue.cart.quantities):
+                dialogue.reply_text += f"Coupon {text} can't be applied to your order"
+            elif coupon is not None:
                 # Add coupon to cart
                 # dialogue.cart_add_coupon(coupon)
                 # Add text to reply
@@ -825,10 +845,110 @@ async def msg(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(update.message.text)
     '''
 
-def main() -> None:
-    """Run the telegram bot."""
+async def sync_catalog(context: ContextTypes.DEFAULT_TYPE) -> None:
+    '''Periodic catalog sync job. job.data is the name of TastyIgniter refresh method.'''
+    await getattr(ti, context.job.data)()
+
+async def reload_snapshot(context: ContextTypes.DEFAULT_TYPE) -> None:
+    '''Periodic job of supervisor.py workers mapping the catalog snapshot when the supervisor has written a new one.'''
+    if not catalog_snapshot.changed():
+        return
+    try:
+        ti.swap(catalog_snapshot.load())
+    except (OSError, ValueError, EOFError) as e:
+        # Keep serving the current catalog, the next check retries
+        logger.error(f"Can't load catalog snapshot {catalog_snapshot.path}: {e}")
+
+async def flush_dialogues(context: ContextTypes.DEFAULT_TYPE) -> None:
+    '''Periodic job writing changed dialogues to disk and dropping idle ones from memory.'''
+    dm.evict()
+    dm.flush()
+
+async def flush_after_update(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    '''Write changed dialogues to disk when the update is handled.'''
+    dm.flush()
+
+async def reload_config(context: ContextTypes.DEFAULT_TYPE) -> None:
+    '''Periodic job reloading configuration when .config.yml is modified.'''
+    config.reload_if_changed()
+
+async def post_init(application: Application) -> None:
+    '''Load the catalog in the bot's event loop before updates are processed.'''
+    # Reload configuration on SIGHUP
+    if hasattr(signal, 'SIGHUP'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, config.reload)
+    # Workers of supervisor.py start with the catalog snapshot of the supervisor
+    if ti.catalog.version == 0:
+        await ti.load()
+
+async def post_shutdown(application: Application) -> None:
+    '''Save dialogues and close Tastyigniter API connections.'''
+    written = dm.close()
+    logger.info(f"Saved {written} dialogues on shutdown. Dialogue cache: {dm.metrics()}")
+    logger.info(f"Button routes: {router.stats()}")
+    await ti.close()
+
+class UserUpdateProcessor(BaseUpdateProcessor):
+    '''Processes updates of different users concurrently. Updates of one user are processed one by one in order,
+    because handlers change the user's dialogue.
+    An update waits for its user's lock before it takes a concurrency slot, so a burst of one user doesn't hold the slots.'''
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.slots = asyncio.Semaphore(max_concurrent_updates)
+
+    async def process_update(self, update: object, coroutine) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self.slots:
+                await self.do_process_update(update, coroutine)
+            return
+        async with dm.user_lock(user.id):
+            async with self.slots:
+                await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+def build_application(receive_updates: bool = True) -> Application:
+    '''Create the Application with handlers and background jobs.
+    Without receive_updates the application has no updater, updates are put in its update_queue by the caller.'''
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(config['tg-token']).build()
+    builder = Application.builder().token(config['tg-token']).post_init(post_init).post_shutdown(post_shutdown)
+    if not receive_updates:
+        builder = builder.updater(None)
+
+    # Number of updates processed at the same time. Updates of one user are always processed in order
+    concurrent_updates = config.get('tg-concurrent-updates', 256)
+    if concurrent_updates > 1:
+        builder = builder.concurrent_updates(UserUpdateProcessor(concurrent_updates))
+    application = builder.build()
+
+    # Workers of supervisor.py reload the catalog snapshot written by the supervisor instead of syncing the catalog
+    if catalog_snapshot is not None and application.job_queue is not None:
+        check_interval = config.get('catalog-snapshot-check-interval', 2)
+        application.job_queue.run_repeating(reload_snapshot, interval=check_interval, first=check_interval, name='reload-snapshot')
+
+    # Schedule background catalog sync. Interval 0 disables the job
+    for name, method, interval in catalog_sync_jobs() if catalog_snapshot is None else []:
+        if not interval:
+            continue
+        if application.job_queue is None:
+            logger.warning(f"Job queue is not available, {name} is disabled. Install python-telegram-bot[job-queue]")
+            continue
+        application.job_queue.run_repeating(sync_catalog, interval=interval, first=interval, name=name, data=method)
+        logger.info(f"Catalog {name} is scheduled every {interval} seconds")
+ 
+    # Reload configuration when the file is modified. Interval 0 disables the check, SIGHUP still works
+    reload_interval = config.get('config-reload-interval', 10)
+    if reload_interval and application.job_queue is not None:
+        application.job_queue.run_repeating(reload_config, interval=reload_interval, first=reload_interval, name='reload-config')
  
     # Add handlers for start and help commands
     application.add_handler(CommandHandler("start", process_usser_action))
@@ -839,8 +959,98 @@ def main() -> None:
     # Add a handler for text messages
     application.add_handler(MessageHandler(filters.TEXT | filters.LOCATION | filters.CONTACT, msg))
 
+    # Write changed dialogues in batches every few seconds or, if the interval is 0, after every update
+    flush_interval = config.get('dialogue-flush-interval', 5)
+    if flush_interval and application.job_queue is not None:
+        application.job_queue.run_repeating(flush_dialogues, interval=flush_interval, first=flush_interval, name='flush-dialogues')
+    else:
+        application.add_handler(TypeHandler(Update, flush_after_update), group=1)
+
+    return application
+
+def catalog_sync_jobs() -> list:
+    '''Background catalog sync: (name, TastyIgniter refresh method, interval). Interval 0 disables the sync.'''
+    return [
+        ('sync-coupons', 'refresh_coupons', config.get('ti-sync-coupons-interval', 0)), # Coupons and currencies
+        ('sync-menus', 'refresh', config.get('ti-sync-menus-interval', 0)), # Menus and locations
+    ]
+
+def main() -> None:
+    """Run the telegram bot."""
+    application = build_application()
+
     # Run the bot until the user presses Ctrl-C
-    application.run_polling()
+    if config.get('tg-mode', 'polling') == 'webhook':
+        application.run_webhook(**webhook_options())
+    else:
+        application.run_polling()
+
+async def run_worker(connection) -> None:
+    '''Process updates sent by supervisor.py through the connection until the supervisor closes it.'''
+    application = build_application(receive_updates=False)
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                data = await loop.run_in_executor(None, connection.recv)
+            except EOFError:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        # Pending updates are processed before the application stops
+        await application.stop()
+        await application.shutdown()
+        await post_shutdown(application)
+
+def webhook_options() -> dict:
+    '''Options of the local HTTP listener which receives updates from Telegram, usually behind a reverse proxy.
+    Requests without the secret token in X-Telegram-Bot-Api-Secret-Token header are rejected,
+    so the webhook can't be started without tg-webhook-secret.'''
+    url = config.get('tg-webhook-url')
+    if not url:
+        raise ValueError("tg-webhook-url is required when tg-mode is webhook")
+    secret = config.get('tg-webhook-secret')
+    if not secret:
+        raise ValueError("tg-webhook-secret is required when tg-mode is webhook")
+
+    listen = config.get('tg-webhook-listen', '127.0.0.1')
+    port = config.get('tg-webhook-port', 8443)
+    path = config.get('tg-webhook-path', 'telegram')
+    logger.info(f"Listening for webhook updates on {listen}:{port}/{path}")
+    return {
+        'listen': listen,
+        'port': port,
+        'url_path': path,
+        'webhook_url': url, # Public URL of the reverse proxy, registered in Telegram on start
+        'secret_token': secret,
+    }
+
+def setup(snapshot_path: str | None = None) -> None:
+    '''Create the objects used by the handlers. Workers of supervisor.py map the catalog snapshot written by the supervisor.'''
+    global config, dm, ti, catalog_snapshot, pricing, render_cache
+
+    # Load config once, it is shared by reference and reloaded in place
+    config = Config.shared()
+    
+    # Create a DialogsManager instance
+    dm = DialoguesManager(config)
+    
+    # Connect to TarastyIgniter API. Catalog is loaded in post_init
+    ti = TastyIgniter(config)
+    catalog_snapshot = None
+    if snapshot_path is not None:
+        catalog_snapshot = SnapshotReader(snapshot_path)
+        ti.swap(catalog_snapshot.load())
+
+    # Cart quotes
+    pricing = PricingEngine(config)
+
+    # Screens which are the same for all users
+    render_cache = RenderCache(config.get('render-cache-size', 1024))
 
 
 if __name__ == "__main__":    
@@ -850,15 +1060,6 @@ if __name__ == "__main__":
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S',
     )
-    logger = logging.getLogger(__name__)
 
-    # Load config
-    config = Config()
-    
-    # Create a DialogsManager instance
-    dm = DialoguesManager(config)
-    
-    # Connect to TarastyIgniter API
-    ti = TastyIgniter(config)
-    
+    setup()
     main()
\ No newline at end of file
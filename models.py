@@ -0,0 +1,336 @@
+'''Compact models of user dialogue state.
+Models keep their fields in __slots__ and only store values which differ from the defaults,
+the defaults are immutable and shared by all users. Dictionary access (nav['current_location'])
+is kept for the handlers.'''
+
+from functools import lru_cache
+from types import MappingProxyType
+
+from classes import Config
+
+
+class Record:
+    '''Fixed set of fields with dictionary access. Keys with dashes are stored in fields with underscores.
+    Unset fields read their shared default.'''
+
+    __slots__ = ()
+    defaults = MappingProxyType({})
+
+    def __init__(self, **values):
+        for key, value in values.items():
+            self[key] = value
+
+    @staticmethod
+    def field(key: str) -> str:
+        return key.replace('-', '_')
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, self.field(key))
+        except AttributeError:
+            if key in self.defaults:
+                return self.defaults[key]
+            raise KeyError(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self.defaults:
+            raise KeyError(key)
+        setattr(self, self.field(key), value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.defaults
+
+    def __iter__(self):
+        return iter(self.defaults)
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self.defaults else default
+
+    def reset(self) -> None:
+        '''Set all fields back to defaults.'''
+        for key in self.defaults:
+            try:
+                delattr(self, self.field(key))
+            except AttributeError:
+                pass
+
+    def compact(self) -> dict:
+        '''Fields which differ from defaults.'''
+        values = {}
+        for key, default in self.defaults.items():
+            value = getattr(self, self.field(key), default)
+            if value is not default and Config.freeze(value) != default:
+                values[key] = value
+        return values
+
+
+class Navigation(Record):
+    '''Where the user is in the bot screens.'''
+
+    __slots__ = ('current_location', 'current_category', 'current_menu_item', 'current_menu_item_options',
+                 'requested', 'text_requested_for', 'after_request_screen', 'message_ids')
+    defaults = MappingProxyType({
+        'current_location': None,
+        'current_category': None,
+        'current_menu_item': None,
+        'current_menu_item_options': None,
+        'requested': MappingProxyType({
+            'user_location': False, # Had user requested to send his location?
+            'user_phone': False, # Had user requested to send his phone number?
+        }),
+        'text_requested_for': None,
+        'after_request_screen': None,
+        'message_ids': (), # Message IDs we sent to user. Used for deleting messages.
+    })
+
+    def __init__(self, **values):
+        # Handlers extend message IDs list
+        self.message_ids = []
+        super().__init__(**values)
+
+    def reset(self) -> None:
+        super().reset()
+        self.message_ids = []
+
+
+class UserProfile(Record):
+    '''User details and the order being prepared.'''
+
+    __slots__ = ('first_name', 'last_name', 'phone', 'location', 'address', 'coupon', 'ti_customer', 'order')
+    defaults = MappingProxyType({
+        'first_name': None,
+        'last_name': None,
+        'phone': None,
+        'location': None,
+        'address': None,
+        'coupon': None,
+        'ti-customer': MappingProxyType({}),
+        'order': None,
+    })
+
+    def compact(self) -> dict:
+        values = super().compact()
+        # Only changed order fields are stored
+        values.pop('order', None)
+        order = self['order']
+        if order is not None and len(order.compact()) > 0:
+            values['order'] = order.compact()
+        return values
+
+
+@lru_cache(maxsize=None)
+def order_defaults(email: str) -> MappingProxyType:
+    '''Default order of Tastyigniter API, shared by all users with the same customer email.'''
+    return Config.freeze({
+        # Required
+        'customer_id': None,
+        'location_id': None,
+        'first_name':  None,
+        'last_name':  None,
+        'email': email,
+        'order_type': 'delivery', # delivery | collection (for pick-up)
+        'delivery_address': None,
+        'payment_method': 'cod',
+        'total_items' : 0,
+        'order_total': 0.0,
+        'order_totals': [
+            {
+                # 'order_total_id': 792, ??? What is this?
+                'order_id': 0,
+                'code': 'subtotal',
+                'title': 'Sub Total',
+                'value': 0.0,
+                'priority': 0,
+                'is_summable': 0
+            },
+            {
+                # 'order_total_id': 791,
+                'order_id': 0,
+                'code': 'delivery',
+                'title': 'Delivery',
+                'value': 0.0,
+                'priority': 100,
+                'is_summable': 1
+            },
+            {
+                # 'order_total_id': 793,
+                'order_id': 0,
+                'code': 'total',
+                'title': 'Order Total',
+                'value': 0.0,
+                'priority': 127,
+                'is_summable': 0
+            }
+        ],
+        'order_menus': [],
+
+        # Optional
+        'telephone': None,
+        'comment': None,
+        'delivery_comment': None,
+        'order_time_is_asap': True,
+        'order_date': None,
+        'order_time': None,
+        'payment': 'cod', # cod | card
+        'processed': 0,
+        'status_id': 0,
+        'status_comment': None,
+    })
+
+
+class Order:
+    '''Order which reads shared defaults and stores only changed fields.'''
+
+    __slots__ = ('defaults', 'changes')
+
+    def __init__(self, defaults: MappingProxyType, changes: dict | None = None):
+        self.defaults = defaults
+        self.changes = None # Created on the first change
+        for key, value in (changes or {}).items():
+            if key not in defaults or Config.freeze(value) != defaults[key]:
+                self[key] = value
+
+    def __getitem__(self, key: str):
+        if self.changes is not None and key in self.changes:
+            return self.changes[key]
+        return self.defaults[key]
+
+    def __setitem__(self, key: str, value) -> None:
+        if self.changes is None:
+            self.changes = {}
+        self.changes[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.defaults or (self.changes is not None and key in self.changes)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self) -> list:
+        return list(self.defaults) + [key for key in self.changes or {} if key not in self.defaults]
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self else default
+
+    def compact(self) -> dict:
+        '''Changed fields.'''
+        return self.changes or {}
+
+
+def new_order(email: str, changes: dict | None = None) -> Order:
+    '''Order with defaults for the customer email.'''
+    return Order(order_defaults(email), changes)
+
+
+class CartLine:
+    '''Menu item in the cart.'''
+
+    __slots__ = ('uid', 'id', 'quantity', 'options')
+    keys = frozenset(__slots__)
+
+    def __init__(self, uid: str, id: int, quantity: int, options: tuple = ()):
+        self.uid = uid
+        self.id = id
+        self.quantity = quantity
+        self.options = tuple(options)
+
+    def __getitem__(self, key: str):
+        if key not in self.keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self.keys:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys
+
+    def compact(self) -> list:
+        '''[uid, id, quantity] or [uid, id, quantity, options]'''
+        if len(self.options) == 0:
+            return [self.uid, self.id, self.quantity]
+        return [self.uid, self.id, self.quantity, list(self.options)]
+
+    @classmethod
+    def restore(cls, data: list | dict) -> 'CartLine':
+        '''Cart line from compact list or from dictionary of the old format.'''
+        if isinstance(data, dict):
+            return cls(data['uid'], data['id'], data['quantity'], data.get('options') or ())
+        return cls(*data)
+
+
+class Cart:
+    '''Cart lines in the order they were added, indexed by uid.
+    Item count and quantities by menu item ID are kept up to date on every change.'''
+
+    __slots__ = ('lines', 'count', 'quantities', 'version', 'cached_quote')
+
+    def __init__(self, lines=()):
+        self.lines = {} # {uid: CartLine}, dictionaries keep insertion order
+        self.count = 0 # Number of items
+        self.quantities = {} # Number of items by menu item ID
+        self.version = 0 # Incremented on every change
+        self.cached_quote = None # (key, quote) of the last pricing.Quote
+        for line in lines:
+            self.add(line if isinstance(line, CartLine) else CartLine.restore(line))
+
+    def __iter__(self):
+        return iter(self.lines.values())
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self.lines
+
+    def get(self, uid: str) -> CartLine | None:
+        return self.lines.get(uid)
+
+    def quantity(self, menu_item_id: int) -> int:
+        '''Number of items with menu item ID in the cart.'''
+        return self.quantities.get(menu_item_id, 0)
+
+    def add(self, line: CartLine) -> None:
+        self.lines[line.uid] = line
+        self.track(line, 1)
+
+    def remove(self, uid: str) -> CartLine | None:
+        line = self.lines.pop(uid, None)
+        if line is not None:
+            self.track(line, -1)
+        return line
+
+    def set_quantity(self, uid: str, quantity: int) -> None:
+        line = self.lines.get(uid)
+        if line is not None:
+            self.track(line, -1)
+            line.quantity = quantity
+            self.track(line, 1)
+
+    def add_option(self, uid: str, option: dict | None) -> None:
+        line = self.lines.get(uid)
+        if line is not None:
+            self.track(line, -1)
+            line.options += (option,)
+            self.track(line, 1)
+
+    def clear(self) -> None:
+        self.lines = {}
+        self.count = 0
+        self.quantities = {}
+        self.version += 1
+
+    def track(self, line: CartLine, sign: int) -> None:
+        '''Add (sign 1) or subtract (sign -1) the line from running totals.'''
+        self.count += sign * line.quantity
+        quantity = self.quantities.get(line.id, 0) + sign * line.quantity
+        if quantity:
+            self.quantities[line.id] = quantity
+        else:
+            self.quantities.pop(line.id, None)
+        self.version += 1
+
+    def compact(self) -> list:
+        return [line.compact() for line in self]
@@ -0,0 +1,97 @@
+'''Cart pricing: subtotal, option surcharges, delivery fee, coupon discount and total.
+Functions here only compute numbers, the screens format them.'''
+
+
+class QuoteLine:
+    '''Priced cart line.'''
+
+    __slots__ = ('uid', 'menu_item_id', 'name', 'currency', 'unit_price', 'quantity', 'total', 'options')
+
+    def __init__(self, uid: str, menu_item_id: int, name: str, currency: str, unit_price: float, quantity: int, options: tuple):
+        self.uid = uid
+        self.menu_item_id = menu_item_id
+        self.name = name
+        self.currency = currency
+        self.unit_price = unit_price
+        self.quantity = quantity
+        self.total = unit_price * quantity # Without options
+        self.options = options # Selected option dictionaries: 'name', 'price', 'currency'
+
+
+class Quote:
+    '''Priced cart. Never changed after it is computed.'''
+
+    __slots__ = ('lines', 'currency', 'subtotal', 'delivery_fee', 'base_delivery_fee', 'free_delivery_limit', 'coupon', 'discount', 'total')
+
+    def __init__(self, lines: tuple, currency: str | None, subtotal: float, delivery_fee: float | None, base_delivery_fee: float,
+                 free_delivery_limit: float, coupon: dict | None, discount: float, total: float):
+        self.lines = lines
+        self.currency = currency # Currency of menu items
+        self.subtotal = subtotal # Menu items with options
+        self.delivery_fee = delivery_fee # None if the order is not delivered
+        self.base_delivery_fee = base_delivery_fee # Fee before free delivery limit is applied
+        self.free_delivery_limit = free_delivery_limit
+        self.coupon = coupon
+        self.discount = discount
+        self.total = total
+
+
+def price_cart(cart, catalog, order_type: str, coupon: dict | None, delivery_fee: float, free_delivery_limit: float) -> Quote:
+    '''Price cart lines with the catalog snapshot.
+    Delivery fee is waived for subtotal reaching free_delivery_limit. Coupon type F is a fixed discount, P is a percentage of subtotal.'''
+    lines = []
+    subtotal = 0.0
+    currency = None
+    for line in cart:
+        attributes = catalog.menu_items[line.id]['data']['attributes']
+        options = tuple(option for option in line.options if option is not None)
+        quote_line = QuoteLine(line.uid, line.id, attributes['menu_name'], attributes['currency'], attributes['menu_price'], line.quantity, options)
+        subtotal += quote_line.total + sum(option['price'] for option in options) * line.quantity
+        currency = quote_line.currency
+        lines.append(quote_line)
+
+    total = subtotal
+    fee = None
+    if order_type == 'delivery':
+        fee = 0 if subtotal >= free_delivery_limit else delivery_fee
+        total += fee
+
+    discount = 0
+    if coupon is not None:
+        if coupon['attributes']['type'] == "F": # Fixed amount
+            discount = float(coupon['attributes']['discount'])
+        elif coupon['attributes']['type'] == "P": # Percentage
+            discount = subtotal * coupon['attributes']['discount'] / 100
+        total -= discount
+
+    # Discount can't be greater than subtotal and total can't be negative
+    discount = min(discount, subtotal)
+    total = max(total, 0)
+
+    return Quote(tuple(lines), currency, subtotal, fee, delivery_fee, free_delivery_limit, coupon, discount, total)
+
+
+class PricingEngine:
+    '''Computes cart quotes and remembers the last quote of every cart.
+    A quote is reused until the cart, the catalog, the order type, the coupon or the delivery settings change.'''
+
+    def __init__(self, config):
+        self.config = config
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def quote(self, cart, catalog, order_type: str, coupon: dict | None = None) -> Quote:
+        '''Quote of the cart priced with the catalog snapshot.'''
+        # Temporary delivery fee settings until the fee is calculated by Tastyigniter
+        delivery_fee = self.config.get('tmp-delivery-fee', 0)
+        free_delivery_limit = self.config.get('tmp-delivery-free-limit', 0)
+
+        coupon_key = None if coupon is None else (coupon['attributes']['code'], coupon['attributes']['type'], coupon['attributes']['discount'])
+        key = (cart.version, catalog.version, order_type, coupon_key, delivery_fee, free_delivery_limit)
+        if cart.cached_quote is not None and cart.cached_quote[0] == key:
+            self.stats['hits'] += 1
+            return cart.cached_quote[1]
+
+        self.stats['misses'] += 1
+        quote = price_cart(cart, catalog, order_type, coupon, delivery_fee, free_delivery_limit)
+        cart.cached_quote = (key, quote)
+        return quote
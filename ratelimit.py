@@ -0,0 +1,120 @@
+import logging, time, random, threading, datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    '''Token bucket allowing rate requests per second with bursts up to capacity.
+    Every request reserves a token and waits until the token is available, so concurrent requests are spread in time.'''
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        '''Initialize bucket. Rate 0 means no limit.'''
+        self.rate = rate
+        self.capacity = capacity if capacity else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0 # No requests until this time (Retry-After)
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        '''Take a token. Returns seconds to wait before the request.'''
+        with self.lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.rate:
+                # Refill tokens. Tokens below zero are reserved by requests which are still waiting
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        '''Stop all requests for some seconds.'''
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class RequestScheduler:
+    '''Schedules API requests: per host token bucket rate limit, retries with exponential backoff and jitter,
+    Retry-After handling. Counts requests, retries and waits.'''
+
+    # Responses worth to retry
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, rate: float = 0, rate_limits: dict | None = None, burst: float | None = None, backoff_base: float = 0.5, backoff_max: float = 30.0):
+        '''Initialize scheduler. rate is requests per second for every host, rate_limits overrides it by host name.'''
+        self.rate = rate
+        self.rate_limits = rate_limits or {}
+        self.burst = burst
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.buckets = {} # Token buckets by host
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0, 'failures': 0, 'wait_seconds': 0.0}
+
+        self.logger = logging.getLogger(__name__)
+
+    def bucket(self, url: str) -> TokenBucket:
+        '''Token bucket of url host.'''
+        host = urlparse(url).hostname
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate_limits.get(host, self.rate), self.burst)
+            return self.buckets[host]
+
+    def reserve(self, url: str) -> float:
+        '''Reserve a request to url. Returns seconds to wait before sending it.'''
+        wait = self.bucket(url).reserve()
+        self.count('requests')
+        if wait > 0:
+            self.count('wait_seconds', wait)
+        return wait
+
+    def should_retry(self, status_code: int) -> bool:
+        return status_code in self.retry_statuses
+
+    def retry_delay(self, url: str, attempt: int, response=None) -> float:
+        '''Seconds to wait before retrying failed request.
+        Retry-After of 429/503 response pauses all requests to the host, otherwise the delay is exponential backoff with jitter.'''
+        self.count('retries')
+        if response is None:
+            self.count('errors')
+            return self.backoff(attempt)
+
+        if response.status_code == 429:
+            self.count('throttled')
+        else:
+            self.count('errors')
+
+        retry_after = self.retry_after(response.headers)
+        if retry_after is not None:
+            self.bucket(url).pause(retry_after)
+            # Spread retries of concurrent requests a little
+            return retry_after + random.uniform(0, self.backoff_base)
+        return self.backoff(attempt)
+
+    def backoff(self, attempt: int) -> float:
+        '''Exponential backoff with full jitter.'''
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def retry_after(self, headers) -> float | None:
+        '''Parse Retry-After header: seconds or HTTP date.'''
+        value = headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            self.logger.warning(f"Can't parse Retry-After: {value}")
+            return None
+
+    def count(self, counter: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[counter] += value
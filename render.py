@@ -0,0 +1,44 @@
+from collections import OrderedDict
+
+
+class Screen:
+    '''Rendered screen: filtered HTML text and keyboard rows.
+    Dynamic text of a user (like opening hours) goes between text and footer.'''
+
+    __slots__ = ('text', 'footer', 'keyboard')
+
+    def __init__(self, text: str, keyboard: list, footer: str = ''):
+        self.text = text
+        self.footer = footer
+        self.keyboard = tuple(tuple(row) for row in keyboard) # Buttons are immutable and shared by all users
+
+
+class RenderCache:
+    '''Screens which are the same for every user of a catalog version, like location and category menus.
+    Keys are (screen, location ID, category ID, catalog version, admin flag). LRU with a size limit,
+    screens of older catalog versions are dropped when a new version is rendered.'''
+
+    def __init__(self, max_screens: int = 1024):
+        self.max_screens = max_screens
+        self.screens = OrderedDict()
+        self.version = None
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, screen: str, location_id: int, category_id: int | None, version: int, is_admin: bool, render) -> Screen:
+        '''Get cached screen or render it by calling render() without arguments.'''
+        if version != self.version:
+            self.screens.clear()
+            self.version = version
+
+        key = (screen, location_id, category_id, version, is_admin)
+        if key in self.screens:
+            self.stats['hits'] += 1
+            self.screens.move_to_end(key)
+            return self.screens[key]
+
+        self.stats['misses'] += 1
+        rendered = render()
+        self.screens[key] = rendered
+        while len(self.screens) > self.max_screens:
+            self.screens.popitem(last=False)
+        return rendered
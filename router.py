@@ -0,0 +1,70 @@
+import logging, time
+from typing import NamedTuple
+
+
+class Callback(NamedTuple):
+    '''Parsed callback_data: "{route}-{id}-{action}-{params}", every part after the route is optional.'''
+    route: str
+    id: int | str | None
+    action: str | None
+    params: str | None
+
+
+class CallbackRouter:
+    '''Dispatches button presses to handlers registered by callback_data prefix.
+    Data is parsed once, the handler is found by a dictionary lookup. Every route has its own timing.'''
+
+    def __init__(self):
+        self.routes = {} # {route: (handler, id type)}
+        self.timings = {} # {route: {'calls', 'seconds', 'max_seconds'}}
+        self.logger = logging.getLogger(__name__)
+
+    def route(self, route: str, id_type: type = str):
+        '''Decorator registering a handler of route. id_type converts the id part, int for location-15.'''
+        def register(handler):
+            if route in self.routes:
+                raise ValueError(f"Route {route} is already registered")
+            self.routes[route] = (handler, id_type)
+            self.timings[route] = {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            return handler
+        return register
+
+    def parse(self, data: str) -> Callback | None:
+        '''Parse callback_data. Returns None for unknown routes and malformed ids.'''
+        parts = data.split("-", 3)
+        if parts[0] not in self.routes:
+            return None
+        parts += [None] * (4 - len(parts))
+
+        _, id_type = self.routes[parts[0]]
+        if parts[1] is not None:
+            try:
+                parts[1] = id_type(parts[1])
+            except ValueError:
+                return None
+        return Callback(*parts)
+
+    async def dispatch(self, callback: Callback, *args):
+        '''Call the route handler with the callback and args. Returns what the handler returns.'''
+        handler, _ = self.routes[callback.route]
+        started = time.perf_counter()
+        try:
+            return await handler(callback, *args)
+        finally:
+            seconds = time.perf_counter() - started
+            timing = self.timings[callback.route]
+            timing['calls'] += 1
+            timing['seconds'] += seconds
+            timing['max_seconds'] = max(timing['max_seconds'], seconds)
+            self.logger.debug(f"Route {callback.route} took {seconds * 1000:.1f} ms")
+
+    def stats(self) -> dict:
+        '''Calls, average and max milliseconds by route.'''
+        return {
+            route: {
+                'calls': timing['calls'],
+                'avg_ms': round(timing['seconds'] / timing['calls'] * 1000, 2) if timing['calls'] else 0.0,
+                'max_ms': round(timing['max_seconds'] * 1000, 2),
+            }
+            for route, timing in self.timings.items()
+        }
@@ -0,0 +1,112 @@
+import datetime
+from bisect import bisect_right
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MINUTES_IN_DAY = 24 * 60
+MINUTES_IN_WEEK = 7 * MINUTES_IN_DAY
+
+# Location info page shows this for both start and end of a closed day
+CLOSED = '00:00 pm'
+
+
+class WeeklySchedule:
+    '''Weekly schedule compiled once into sorted minute-of-week intervals.
+    Open/closed status and the next opening time are found by bisect.'''
+
+    def __init__(self, days: dict):
+        '''Compile schedule of a week: {'mon': {'start': '12:00 pm', 'end': '08:30 pm'}, ...}'''
+        intervals = []
+        for day_index, day in enumerate(DAYS):
+            hours = days.get(day)
+            if hours is None:
+                continue
+            start_time, end_time = self.normalize_time(hours['start']), self.normalize_time(hours['end'])
+            if start_time == CLOSED and end_time == CLOSED:
+                continue
+
+            start = day_index * MINUTES_IN_DAY + self.parse_time(start_time)
+            end = day_index * MINUTES_IN_DAY + self.parse_time(end_time)
+            # Midnight end time and overnight spans end on the next day. Same start and end means open all day
+            if end <= start:
+                end += MINUTES_IN_DAY
+
+            # Spans over Sunday midnight continue on Monday
+            if end > MINUTES_IN_WEEK:
+                intervals.append((start, MINUTES_IN_WEEK))
+                intervals.append((0, end - MINUTES_IN_WEEK))
+            else:
+                intervals.append((start, end))
+
+        # Merge overlapping and adjacent intervals
+        merged = []
+        for start, end in sorted(intervals):
+            if len(merged) > 0 and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+
+        self.starts = [start for start, _ in merged]
+        self.ends = [end for _, end in merged]
+
+    @staticmethod
+    def normalize_time(value: str) -> str:
+        '''Time of the location info page in the form of CLOSED: ' 08:30 PM ' is '08:30 pm'.'''
+        return " ".join(value.lower().split())
+
+    @staticmethod
+    def parse_time(value: str) -> int:
+        '''Minutes since midnight of normalized '08:30 pm'. '00:00 pm' is midnight.'''
+        clock, period = value.split()
+        hours, minutes = clock.split(':')
+        hours = int(hours) % 12
+        if period == 'pm' and value != CLOSED:
+            hours += 12
+        return hours * 60 + int(minutes)
+
+    @staticmethod
+    def format_time(minute_of_week: int) -> str:
+        '''Format minute of week as '08:30 pm'.'''
+        minutes = minute_of_week % MINUTES_IN_DAY
+        hours = minutes // 60
+        return f"{(hours % 12) or 12:02d}:{minutes % 60:02d} {'am' if hours < 12 else 'pm'}"
+
+    @staticmethod
+    def minute_of_week(now: datetime.datetime) -> int:
+        return now.weekday() * MINUTES_IN_DAY + now.hour * 60 + now.minute
+
+    def is_open(self, now: datetime.datetime) -> bool:
+        minute = self.minute_of_week(now)
+        index = bisect_right(self.starts, minute) - 1
+        return index >= 0 and minute < self.ends[index]
+
+    def status(self, now: datetime.datetime) -> dict:
+        '''Returns {'status': open or not, 'ends': closing time if open, 'starts': next opening time if closed}.
+        Opening time on another day is followed by the day name: '12:00 pm on Monday'.'''
+        status = {'status': False, 'starts': '', 'ends': ''}
+        if len(self.starts) == 0:
+            return status
+
+        minute = self.minute_of_week(now)
+        index = bisect_right(self.starts, minute) - 1
+
+        if index >= 0 and minute < self.ends[index]:
+            status['status'] = True
+            # Interval which ends at Sunday midnight may go on from Monday midnight
+            end = self.ends[index]
+            if end == MINUTES_IN_WEEK and self.starts[0] == 0:
+                end = self.ends[0]
+            status['ends'] = self.format_time(end)
+            return status
+
+        # Next interval, after the last one comes the first one of the next week
+        start = self.starts[index + 1] if index + 1 < len(self.starts) else self.starts[0]
+        status['starts'] = self.format_time(start)
+        if start // MINUTES_IN_DAY != now.weekday() or start <= minute:
+            status['starts'] += " on " + DAY_NAMES[start // MINUTES_IN_DAY]
+        return status
+
+
+def compile_schedule(schedule: dict) -> dict:
+    '''Compile location schedule: {order_type: WeeklySchedule}.'''
+    return {order_type: WeeklySchedule(days) for order_type, days in schedule.items()}
@@ -0,0 +1,132 @@
+'''Catalog snapshot file shared by worker processes.
+The loader writes the catalog to one binary file, workers memory-map it. Large tables are stored record by record,
+so a worker decodes only the records it reads and the file pages are shared by all workers through the page cache.
+The file is replaced atomically. Workers compare the stamp in its header to reload a new one.'''
+
+import marshal, mmap, os, struct, tempfile, time
+from collections.abc import Mapping
+
+from catalog import Catalog
+
+MAGIC = b'TICATv1\0'
+HEADER = struct.Struct('<8sQQQ') # Magic, stamp, catalog version, size of table directory
+
+# Tables stored record by record and decoded on access. The rest are decoded when the snapshot is mapped
+MAPPED_TABLES = ('locations', 'menus', 'categories', 'menu_items', 'menu_positions')
+
+
+def write(path: str, catalog: Catalog) -> int:
+    '''Write the catalog snapshot. Returns its stamp.'''
+    directory = {} # {field: ('table', record index) or ('value', offset, length)}
+    data = bytearray()
+    for field in Catalog.fields:
+        value = getattr(catalog, field)
+        if field in MAPPED_TABLES:
+            index = {}
+            for key, record in value.items():
+                encoded = marshal.dumps(record)
+                index[key] = (len(data), len(encoded))
+                data += encoded
+            directory[field] = ('table', index)
+        else:
+            encoded = marshal.dumps(value)
+            directory[field] = ('value', len(data), len(encoded))
+            data += encoded
+
+    # Stamp changes with every write, even if the catalog version is the same
+    stamp = time.time_ns()
+    encoded_directory = marshal.dumps(directory)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".catalog_", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, stamp, catalog.version, len(encoded_directory)))
+            f.write(encoded_directory)
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return stamp
+
+
+def read_stamp(path: str) -> int | None:
+    '''Stamp of the snapshot file, None if there is no valid snapshot.'''
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, stamp, _, _ = HEADER.unpack(header)
+    return stamp if magic == MAGIC else None
+
+
+class MappedTable(Mapping):
+    '''Read-only dictionary table of a mapped snapshot. Records are decoded on first access.'''
+
+    __slots__ = ('buffer', 'start', 'index', 'records')
+
+    def __init__(self, buffer: mmap.mmap, start: int, index: dict):
+        self.buffer = buffer
+        self.start = start # Offset of the data section
+        self.index = index # {key: (offset, length)}
+        self.records = {} # Decoded records by key
+
+    def __getitem__(self, key):
+        try:
+            return self.records[key]
+        except KeyError:
+            offset, length = self.index[key]
+        offset += self.start
+        record = self.records[key] = marshal.loads(self.buffer[offset:offset + length])
+        return record
+
+    def __contains__(self, key) -> bool:
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+def load(path: str) -> tuple[int, Catalog]:
+    '''Map the snapshot file. Returns its stamp and the catalog.'''
+    with open(path, 'rb') as f:
+        # The mapping stays valid when the file is replaced, it is closed with the last table using it
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, stamp, version, directory_size = HEADER.unpack(buffer[:HEADER.size])
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a catalog snapshot")
+    directory = marshal.loads(buffer[HEADER.size:HEADER.size + directory_size])
+    start = HEADER.size + directory_size
+
+    fields = {}
+    for field, entry in directory.items():
+        if entry[0] == 'table':
+            fields[field] = MappedTable(buffer, start, entry[1])
+        else:
+            _, offset, length = entry
+            fields[field] = marshal.loads(buffer[start + offset:start + offset + length])
+    return stamp, Catalog(version, **fields)
+
+
+class SnapshotReader:
+    '''Catalog of a worker process, reloaded when the loader writes a new snapshot.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stamp = None
+
+    def load(self) -> Catalog:
+        self.stamp, catalog = load(self.path)
+        return catalog
+
+    def changed(self) -> bool:
+        '''Check if a new snapshot was written since it was loaded.'''
+        stamp = read_stamp(self.path)
+        return stamp is not None and stamp != self.stamp
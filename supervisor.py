@@ -0,0 +1,240 @@
+'''Multi-process mode: the supervisor receives updates from Telegram and forwards them to worker processes.
+Updates are sharded by user ID, so all updates of a user are processed by the same worker in order.
+The supervisor loads and syncs the catalog and writes it to a snapshot file which the workers memory-map.
+Dialogues are kept in the dialogue store, set "dialogue-store: sqlite" to keep them in one database.
+Run: python3 supervisor.py [workers]'''
+
+import asyncio, logging, multiprocessing, os, queue, signal, sys, threading
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+import main, snapshot
+from classes import Config
+from tastyigniter import TastyIgniter
+
+# Seconds to wait for a worker to finish its updates on shutdown before it is killed
+SHUTDOWN_TIMEOUT = 30
+
+
+def run_worker(connection, snapshot_path: str) -> None:
+    '''Worker process: handle updates from the connection with the catalog snapshot of the supervisor.'''
+    # Workers stop when the supervisor closes their connections, after pending updates are processed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # Configuration reloads forwarded by the supervisor are handled after post_init, until then they are ignored
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    main.setup(snapshot_path)
+    asyncio.run(main.run_worker(connection))
+
+
+class Supervisor:
+    '''Loads the catalog for all workers, starts workers, forwards updates to them and restarts the ones which have died.'''
+
+    def __init__(self, config, workers: int):
+        self.config = config
+        self.ti = TastyIgniter(config)
+        self.snapshot_path = config.get('catalog-snapshot', "cache/catalog.snapshot")
+        self.snapshot_version = None # Catalog version written to the snapshot
+        self.refreshes = set() # Refreshes requested by workers
+        main.config = config # Read by main.webhook_options() and main.catalog_sync_jobs()
+        # Workers are restarted while sender threads are running, forking them could copy a held lock.
+        # Spawned workers start clean, everything they need is in the config and the snapshot file
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [None] * workers # (process, connection) by worker number
+        # Updates waiting to be sent by worker number. A stuck worker fills only its own queue
+        self.queues = [queue.Queue(maxsize=config.get('worker-queue-size', 1000)) for _ in range(workers)]
+        self.senders = [] # Threads sending queued updates to the workers
+        self.stats = {'forwarded': 0, 'restarts': 0, 'dropped': 0}
+        self.logger = logging.getLogger(__name__)
+
+    async def load(self) -> None:
+        '''Load the catalog and write the first snapshot.'''
+        await self.ti.load()
+        await self.write_snapshot()
+        if self.snapshot_version is None:
+            exit(1)
+        # Workers create their own API connections
+        await self.ti.close()
+
+    async def write_snapshot(self) -> None:
+        '''Write the current catalog to the snapshot if it has changed.'''
+        catalog = self.ti.catalog
+        if catalog.version == self.snapshot_version:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, snapshot.write, self.snapshot_path, catalog)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Can't write catalog snapshot {self.snapshot_path}: {e}")
+            return
+        self.snapshot_version = catalog.version
+        self.logger.info(f"Catalog v{catalog.version} is written to {self.snapshot_path}")
+
+    async def sync(self, method: str, interval: float) -> None:
+        '''Refresh the catalog every interval seconds.'''
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh(method)
+
+    async def refresh(self, method: str = 'refresh') -> None:
+        '''Refresh the catalog with a TastyIgniter refresh method and write the snapshot for the workers.'''
+        await getattr(self.ti, method)()
+        await self.write_snapshot()
+
+    def refresh_soon(self) -> None:
+        task = asyncio.create_task(self.refresh())
+        self.refreshes.add(task)
+        task.add_done_callback(self.refreshes.discard)
+
+    def reload_config(self) -> None:
+        '''Reload configuration and let the workers reload it too.'''
+        self.config.reload()
+        for process, connection in self.workers:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    def start(self) -> None:
+        for index in range(len(self.workers)):
+            self.start_worker(index)
+        for index in range(len(self.workers)):
+            # Daemon threads don't keep the supervisor alive if a worker never reads its pipe
+            sender = threading.Thread(target=self.send_updates, args=(index,), name=f"sender-{index}", daemon=True)
+            sender.start()
+            self.senders.append(sender)
+
+    def start_worker(self, index: int) -> None:
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=run_worker, args=(receiver, self.snapshot_path), name=f"worker-{index}")
+        process.start()
+        receiver.close()
+        self.workers[index] = (process, sender)
+        self.logger.info(f"Worker {index} is started, pid {process.pid}")
+
+    def shard(self, update: Update) -> int:
+        '''Worker number of the update. Updates without a user go to the first worker.'''
+        user = update.effective_user
+        return user.id % len(self.workers) if user is not None else 0
+
+    def forward(self, update: Update) -> None:
+        '''Queue the update for its worker without blocking. A dead worker is restarted first.
+        If the worker doesn't keep up and its queue is full, the update is dropped.'''
+        index = self.shard(update)
+        process, connection = self.workers[index]
+        if not process.is_alive():
+            self.logger.error(f"Worker {index} has died with exit code {process.exitcode}, restarting it")
+            connection.close()
+            self.stats['restarts'] += 1
+            self.start_worker(index)
+
+        try:
+            self.queues[index].put_nowait(update.to_dict())
+        except queue.Full:
+            self.stats['dropped'] += 1
+            self.logger.error(f"Worker {index} is not keeping up, update {update.update_id} is dropped")
+
+    def send_updates(self, index: int) -> None:
+        '''Sender thread of a worker: write queued updates to its pipe until None is queued.
+        Pipe writes block while the worker is busy, so they are kept out of the event loop.'''
+        while True:
+            data = self.queues[index].get()
+            if data is None:
+                return
+            # The connection is replaced when the worker is restarted
+            process, connection = self.workers[index]
+            try:
+                connection.send(data)
+                self.stats['forwarded'] += 1
+            except OSError as e:
+                # The worker is restarted on its next update
+                self.stats['dropped'] += 1
+                self.logger.error(f"Can't send update {data['update_id']} to worker {index}: {e}")
+
+    async def run(self) -> None:
+        '''Receive updates by polling or webhook and forward them until SIGINT or SIGTERM.'''
+        queue = asyncio.Queue()
+        updater = Updater(Bot(self.config['tg-token']), queue)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        # Admin reload button in a worker
+        tasks = set()
+        loop.add_signal_handler(signal.SIGUSR1, self.refresh_soon)
+        # Configuration reload, the default action would kill the supervisor and all workers with it
+        loop.add_signal_handler(signal.SIGHUP, self.reload_config)
+
+        # The supervisor is the only process syncing the catalog
+        for name, method, interval in main.catalog_sync_jobs():
+            if interval:
+                tasks.add(asyncio.create_task(self.sync(method, interval)))
+                self.logger.info(f"Catalog {name} is scheduled every {interval} seconds")
+
+        async with updater:
+            if self.config.get('tg-mode', 'polling') == 'webhook':
+                await updater.start_webhook(**main.webhook_options())
+            else:
+                await updater.start_polling()
+
+            forwarding = asyncio.create_task(self.forward_updates(queue))
+            await stop.wait()
+            await updater.stop()
+            forwarding.cancel()
+            for task in tasks:
+                task.cancel()
+        await self.ti.close()
+
+        # Forward the updates which are already received
+        while not queue.empty():
+            self.forward(queue.get_nowait())
+
+    async def forward_updates(self, queue: asyncio.Queue) -> None:
+        while True:
+            self.forward(await queue.get())
+
+    def stop_sender(self, index: int) -> None:
+        '''Let the sender thread send queued updates and finish.'''
+        try:
+            self.queues[index].put(None, timeout=SHUTDOWN_TIMEOUT)
+        except queue.Full:
+            return
+        self.senders[index].join(SHUTDOWN_TIMEOUT)
+
+    def stop(self) -> None:
+        '''Send queued updates, close connections and wait for workers to finish pending updates and save dialogues.
+        Workers which don't finish in SHUTDOWN_TIMEOUT seconds are killed.'''
+        for index, sender in enumerate(self.senders):
+            self.stop_sender(index)
+        for index, (process, connection) in enumerate(self.workers):
+            if len(self.senders) > 0 and self.senders[index].is_alive():
+                # The worker doesn't read its pipe. Killing it breaks the pipe and lets the sender finish
+                self.logger.error(f"Worker {index} is stuck, killing it")
+                process.kill()
+                self.stop_sender(index)
+            connection.close()
+        for index, (process, connection) in enumerate(self.workers):
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                self.logger.error(f"Worker {index} has not stopped in {SHUTDOWN_TIMEOUT} seconds, killing it")
+                process.kill()
+                process.join()
+            self.logger.info(f"Worker {index} has stopped with exit code {process.exitcode}")
+        self.logger.info(f"Supervisor stopped: {self.stats}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+    config = Config.shared()
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else config.get('workers', 0) or os.cpu_count()
+
+    supervisor = Supervisor(config, workers)
+    asyncio.run(supervisor.load())
+    supervisor.start()
+    try:
+        asyncio.run(supervisor.run())
+    finally:
+        supervisor.stop()
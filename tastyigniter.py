@@ -1,25 +1,57 @@
-import logging, requests, json, time, hashlib, os
-import requests, datetime
+import logging, time, asyncio
+import datetime, httpx, importlib.util
 from bs4 import BeautifulSoup
+from catalog import Catalog
+from cache import ResponseCache
+from ratelimit import RequestScheduler
+from schedule import WeeklySchedule, compile_schedule
+
+# lxml parses location pages much faster than the pure Python parser, use it if it is installed
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') is not None else 'html.parser'
+
+
+class APIError(Exception):
+    '''Tastyigniter API request failed.'''
+
 
 class TastyIgniter():
-    '''API class for Tastyigniter API requests.'''
+    '''API class for Tastyigniter API requests.
+    Methods doing requests are awaitables. Requests share a keep-alive connection pool and never block the event loop.'''
+
+    # Lists loaded with every catalog
+    list_uris = {
+        'menu_options': "menu_item_options?pageLimit=1000",
+        'currencies': "currencies?enabled=true&pageLimit=1000",
+        'coupons': "coupons?include=menus,locations&enabled=true&pageLimit=1000", # Relationships are indexed by Catalog
+        'customers': "customers?include=addresses&pageLimit=1000",
+    }
+
     def __init__(self, config):
-        '''Initialize API class.'''
+        '''Initialize API class. Catalog is loaded by awaiting load() in the running event loop.'''
         self.config = config
-        self.attempts = 0 # Number of attempts to connect to API
-
-        self.active_locations = [] # Locations list
-        self.locations = {} # Locations dictionary by location_id
-        self.menus = {} # Menus dictionary by ['location_id']['category_id']
-  
-        self.categories = {} # Categories dictionary by category ID
-        self.menu_items = {} # Menu items dictionary by menu item ID
-        self.menu_options = {} # Menu options dictionary by menu option ID
-        self.currencies = {} #Currencies dictionary by currency ID
-        self.coupons = {} # Coupons dictionary by coupon ID
-
-        self.api_request_counter = 0 # Number of API requests
+
+        # Current catalog snapshot. Data is read through the properties below
+        self.catalog = Catalog()
+        # Only one refresh may build a new catalog at a time, set while one is running
+        self.refreshing = False
+        self.sync_stats = {} # Runs, failures and durations of catalog refreshes by name
+
+        # Parsed location info pages: {location_id: {'options', 'schedule', 'compiled', 'fetched_at'}}
+        self.location_info = {}
+        self.location_info_refreshing = set() # Location IDs which info is being refreshed in background
+
+        # Rate limits, retries and request counters
+        self.scheduler = RequestScheduler(
+            rate=config.get('ti-api-rate-limit', 0),
+            rate_limits=config.get('ti-api-rate-limits', {}),
+            burst=config.get('ti-api-burst', None),
+            backoff_base=config.get('ti-api-backoff-base', 0.5),
+            backoff_max=config.get('ti-api-backoff-max', 30),
+        )
+ 
+        # Not more than ti-api-concurrency requests are in flight
+        self.concurrency = config.get('ti-api-concurrency', 8)
+        self.open_session()
  
         # Set up the logger
         logging.basicConfig(
@@ -33,32 +65,236 @@ class TastyIgniter():
         self.logger.info("Connecting to Tastyigniter API...")
 
         # Chek if cache is enabled
+        self.cache = None
         if config['ti-api-cache']:
             self.logger.info("Tastyigniter API cache is enabled")
-            # Create cache directory if it doesn't exist and 
-            if not os.path.exists("cache"):
-                os.mkdir("cache")
-                self.logger.info("Cache directory created")
+            self.cache = ResponseCache(
+                "cache",
+                ttls=config.get('ti-api-cache-ttl', {}),
+                max_bytes=config.get('ti-api-cache-max-bytes', 64 * 1024 * 1024),
+                memory_bytes=config.get('ti-api-cache-memory-bytes', 8 * 1024 * 1024),
+            )
         else:
             self.logger.info("Tastyigniter API cache is disabled")
-  
-        self.load()
         # print_menus() # DEBUG. Print menus for all active locations
 
-    def load(self):
-        self.active_locations = []
-        
+    def open_session(self) -> None:
+        '''Connection pool is created on first request, in the running event loop.'''
+        self.client = None
+        self.semaphore = None
+        self.background_tasks = set()
+
+    def get_client(self) -> httpx.AsyncClient:
+        '''Get async HTTP session.'''
+        if self.client is None:
+            # Requests wait for a free connection as long as needed, the semaphore limits how many are in flight
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                timeout=httpx.Timeout(30.0, pool=None),
+            )
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.client
+
+    async def close(self) -> None:
+        '''Close HTTP session.'''
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    # Catalog data of the current snapshot
+    @property
+    def active_locations(self) -> list:
+        return self.catalog.active_locations
+
+    @property
+    def locations(self) -> dict:
+        return self.catalog.locations
+
+    @property
+    def menus(self) -> dict:
+        return self.catalog.menus
+
+    @property
+    def categories(self) -> dict:
+        return self.catalog.categories
+
+    @property
+    def menu_items(self) -> dict:
+        return self.catalog.menu_items
+
+    @property
+    def menu_options(self) -> list:
+        return self.catalog.menu_options
+
+    @property
+    def currencies(self) -> list:
+        return self.catalog.currencies
+
+    @property
+    def coupons(self) -> list:
+        return self.catalog.coupons
+
+    @property
+    def customers(self) -> list:
+        return self.catalog.customers
+
+    @property
+    def category_locations(self) -> dict:
+        return self.catalog.category_locations
+
+    @property
+    def item_categories(self) -> dict:
+        return self.catalog.item_categories
+
+    @property
+    def menu_positions(self) -> dict:
+        return self.catalog.menu_positions
+
+    async def load(self):
+        '''Load the catalog and make it current.'''
+        try:
+            self.swap(await self.build_catalog())
+        except APIError as e:
+            self.loading_failed(e)
+
+    def loading_failed(self, error: APIError) -> None:
+        '''Exit the program if the catalog can't be loaded.'''
+        self.logger.error(f"Error while loading catalog: {error}")
+        self.logger.info("1. Check API URL and API token in your configuration file")
+        self.logger.info("2. Check if Tastyigniter API is running")
+        self.logger.info("3. Check if Tastyigniter API is accessible from this machine")
+        self.logger.info("4. Check if the endpoint is enabled in Tastyigniter API for this token")
+        exit(1)
+
+    async def refresh(self) -> dict | None:
+        '''Build a new catalog while the current one is still served, log what has changed and swap it in.
+        Returns changes or None if the refresh was skipped or failed.'''
+        if self.refreshing:
+            self.logger.info("Catalog refresh is already running")
+            return None
+        self.refreshing = True
+
+        started = time.monotonic()
+        try:
+            # Cached responses would give us the same catalog again, revalidate them
+            self.clear_cache()
+
+            catalog = await self.build_catalog()
+            changes = self.catalog.diff(catalog)
+            self.swap(catalog)
+        except (Exception, SystemExit) as e:
+            # Keep serving the current catalog
+            self.logger.error(f"Catalog refresh failed, keeping catalog v{self.catalog.version}: {e}")
+            self.record_sync('menus', started, False)
+            return None
+        finally:
+            self.refreshing = False
+
+        self.log_changes(changes, catalog)
+        self.record_sync('menus', started, True)
+        return changes
+
+    async def refresh_coupons(self) -> bool:
+        '''Reload coupons and currencies only and swap them in. Returns True on success.'''
+        if self.refreshing:
+            self.logger.info("Catalog refresh is already running")
+            return False
+        self.refreshing = True
+
+        started = time.monotonic()
+        try:
+            self.clear_cache('currencies', 'coupons')
+            currencies, coupons = await self.request_many([self.list_uris['currencies'], self.list_uris['coupons']])
+            self.swap(self.catalog.replace(currencies=currencies['data'], coupons=coupons['data']))
+        except (Exception, SystemExit) as e:
+            self.logger.error(f"Coupons refresh failed, keeping catalog v{self.catalog.version}: {e}")
+            self.record_sync('coupons', started, False)
+            return False
+        finally:
+            self.refreshing = False
+
+        self.record_sync('coupons', started, True)
+        return True
+
+    def record_sync(self, name: str, started: float, succeeded: bool) -> None:
+        '''Record duration and result of a catalog refresh.'''
+        duration = time.monotonic() - started
+        stats = self.sync_stats.setdefault(name, {'runs': 0, 'failures': 0, 'last_duration': 0.0, 'max_duration': 0.0, 'last_run': None})
+        stats['runs'] += 1
+        if not succeeded:
+            stats['failures'] += 1
+        stats['last_duration'] = duration
+        stats['max_duration'] = max(stats['max_duration'], duration)
+        stats['last_run'] = datetime.datetime.now()
+        self.logger.info(f"Catalog sync '{name}' {'finished' if succeeded else 'failed'} in {duration:.2f}s")
+
+    def swap(self, catalog: Catalog) -> None:
+        '''Make the catalog current. Readers get either the old or the new snapshot, never a mix.'''
+        self.catalog = catalog
+        self.logger.info(f"Catalog v{catalog.version} is loaded: {len(catalog.menu_items)} menu items in {len(catalog.categories)} categories")
+
+    def log_changes(self, changes: dict, catalog: Catalog) -> None:
+        '''Log menu items which were added, removed or re-priced by a refresh.'''
+        if not any(changes.values()):
+            self.logger.info("Catalog has not changed")
+            return
+
+        self.logger.info(f"Catalog changes: {len(changes['added'])} added, {len(changes['removed'])} removed, {len(changes['repriced'])} re-priced")
+        for menu_item_id in changes['added']:
+            self.logger.info(f"[Added] {menu_item_id} {catalog.name(menu_item_id)} {catalog.price(menu_item_id)}")
+        for menu_item_id in changes['removed']:
+            self.logger.info(f"[Removed] {menu_item_id}")
+        for menu_item_id in changes['repriced']:
+            self.logger.info(f"[Re-priced] {menu_item_id} {catalog.name(menu_item_id)} {catalog.price(menu_item_id)}")
+
+    async def build_catalog(self) -> Catalog:
+        '''Load everything from Tastyigniter API into a new catalog snapshot.'''
+        catalog = {field: factory() for field, factory in Catalog.fields.items()}
+
         # Get active locations for connection check
-        response = self.request(f"locations?location_status=true&inclede=options")['data']
+        catalog['active_locations'] = self.select_active_locations((await self.request(f"locations?location_status=true&inclede=options"))['data'])
+
+        # Parse location info pages concurrently
+        parsed_locations = await asyncio.gather(*[self.parse_location_info(location) for location in catalog['active_locations']])
+        for location, parsed_location in zip(catalog['active_locations'], parsed_locations):
+            location.update(parsed_location)
+            self.store_location_info(int(location['id']), parsed_location)
+
+        # Get categories list
+        categories_list = (await self.request(f"categories?include=locations&pageLimit=1000"))['data']
+        # Get categories details
+        categories_ids = [int(category['id']) for category in categories_list]
+        self.add_categories(catalog, categories_ids, await self.request_many([f"categories/{category_id}?include=menus,locations" for category_id in categories_ids]))
+
+        # Get menu options, currencies, coupons and customers lists
+        for field, response in zip(self.list_uris, await self.request_many(list(self.list_uris.values()))):
+            catalog[field] = response['data']
+
+        self.logger.info("Loading menus for active locations...")
+        # Get location details
+        locations_ids = [int(location['id']) for location in catalog['active_locations']]
+        locations_details = await self.request_many([f"locations/{location_id}?include=working_hours,media" for location_id in locations_ids])
+        # Load categories and menu items for each active location
+        for location_id, location in zip(locations_ids, locations_details):
+            catalog['locations'][location_id] = location['data']
+
+            # Load menu
+            catalog['menus'][location_id] = await self.load_menu(location_id, catalog)
+
+        return Catalog(self.catalog.version + 1, **catalog)
+
+    def select_active_locations(self, locations: list) -> list:
+        '''Select locations from location-ids config list.'''
+        active_locations = []
 
         # Check if there are any locations 
-        if len(response) == 0:
+        if len(locations) == 0:
             self.logger.error("There are no locations on Tastyigniter side")
             self.logger.info("Please create location on Teastyigniter side and check your configuration file")
             # TODO: offer to create location through bot and add it to config
             exit(0)
         # Check if location-ids list from config matches any location_id from Tastyigniter API response
-        for location in response:
+        for location in locations:
             if int(location['id']) in self.config['location-ids']:
                 # WARNING: This is a temporary solution.
                 # get location details via API and add it to locations dictionary
@@ -68,78 +304,117 @@ class TastyIgniter():
                 # So we can't get location details via API
                 # TODO: create an issue on Tastyigniter GitHub 
                 # https://github.com/tastyigniter/ti-ext-api/blob/master/docs/locations.md
-
-                parsed_location = self.parse_location_info(location)
-                location['options'] = parsed_location['options']
-                location['schedule'] = parsed_location['schedule']
-                self.active_locations.append(location)
+                active_locations.append(location)
                 
                 # print active locations coloring them green
                 self.logger.info(f"[Active] {location['id']} {location['attributes']['location_name']}")
             else:
                 self.logger.info(f"[Inactive] {location['id']} {location['attributes']['location_name']}")
         # Check if there are any active locations
-        if len(self.active_locations) == 0:
+        if len(active_locations) == 0:
             self.logger.error("location-ids list from config doesn't match any location_id on Tastyigniter side")
             self.logger.info("Please set correct location ID in your configuration file")
             exit(1)
-        
-        # Get categories list 
-        categories_list = self.request(f"categories?include=locations&pageLimit=1000")['data']
-        # Get categories details
-        for category in categories_list:
-            category_id = int(category['id'])
-            self.categories[category_id] = self.request(f"categories/{category_id}?include=menus,locations")['data']
 
-        # Get menu options list
-        self.menu_options = self.request(f"menu_item_options?pageLimit=1000")['data']
+        return active_locations
 
-        # Get currencies list
-        self.currencies = self.request(f"currencies?enabled=true&pageLimit=1000")['data']
-        
-        # Get coupons list
-        self.coupons = self.request(f"coupons?include=menus&enabled=true&pageLimit=1000")['data']
-   
-        # Get customers list
-        self.customers = self.request(f"customers?include=addresses&pageLimit=1000")['data']
-   
-        self.logger.info("Loading menus for active locations...")
-        # Load categories and menu items for each active location
-        for location in self.active_locations:
-            location_id = int(location['id'])
-            # Get location details
-            self.locations[location_id] = self.request(f"locations/{location_id}?include=working_hours,media")['data']
-   
-            # Load menu
-            self.menus[location_id] = self.load_menu(location_id)    
+    def add_categories(self, catalog: dict, categories_ids: list, categories_details: list) -> None:
+        '''Add categories details to the catalog being built and index their locations.'''
+        for category_id, category in zip(categories_ids, categories_details):
+            catalog['categories'][category_id] = category['data']
+            catalog['category_locations'][category_id] = {int(location['id']) for location in category['data']['relationships']['locations']['data']}
 
-    def load_menu(self, location_id: int) -> dict:
-        '''Load menu for a specific location.'''
-        menu = {} # {category_id: {menu_items_ids}}
-  
+    async def load_menu(self, location_id: int, catalog: dict) -> dict:
+        '''Load menu for a specific location into the catalog being built.'''
         # Get menu items list for location
-        menu_items_list = self.request(f"menus?location={location_id}&include=media")['data']
-        # print(menu_items_list)
+        if self.config.get('ti-api-batch-menus', False):
+            menu_items_list = await self.load_menu_items_batch(location_id, catalog['menu_items'])
+        else:
+            menu_items_list = (await self.request(f"menus?location={location_id}&include=media"))['data']
+
+        # Get details of menu items which are not loaded yet
+        missing_ids = self.missing_menu_items(location_id, menu_items_list, catalog['menu_items'])
+        missing_details = await self.request_many([f"menus/{menu_item_id}?include=media,categories,menu_options" for menu_item_id in missing_ids])
+        for menu_item_id, details in zip(missing_ids, missing_details):
+            catalog['menu_items'][menu_item_id] = details
+
+        return self.assemble_menu(location_id, catalog, menu_items_list)
+
+    def missing_menu_items(self, location_id: int, menu_items_list: list, menu_items: dict) -> list:
+        '''IDs of menu items from the list which details are not loaded yet.'''
+        missing_ids = [int(menu_item['id']) for menu_item in menu_items_list if int(menu_item['id']) not in menu_items]
+        if len(missing_ids) > 0:
+            self.logger.info(f"Requesting details of {len(missing_ids)} menu items for location {location_id}")
+        return missing_ids
 
-        # Iterate through categories
-        for category_id in self.categories:
-            # Check if category belongs to location
-            if {'type': 'locations', 'id': str(location_id)} in self.categories[category_id]['relationships']['locations']['data']:
+    def assemble_menu(self, location_id: int, catalog: dict, menu_items_list: list) -> dict:
+        '''Build menu of a location from loaded menu items.'''
+        menu = {} # {category_id: {menu_items_ids}}
+        menu_items = catalog['menu_items']
+        item_categories = catalog['item_categories']
+
+        # Index categories of every menu item
+        for menu_item in menu_items_list:
+            menu_item_id = int(menu_item['id'])
+            if menu_item_id not in item_categories:
+                categories = menu_items[menu_item_id]['data']['relationships']['categories']['data']
+                item_categories[menu_item_id] = {int(category['id']) for category in categories}
+
+        # Categories which belong to location, in categories order
+        for category_id in catalog['categories']:
+            if location_id in catalog['category_locations'][category_id]:
                 menu[category_id] = []
-                # Iterate through menu items    
-                for menu_item in menu_items_list:
-                    menu_item_id = int(menu_item['id'])
-                    # Add menu item to menu dictionary if it is not already there
-                    if menu_item_id not in self.menu_items:
-                        # Get menu items details
-                        self.menu_items[menu_item_id] = self.request(f"menus/{menu_item_id}?include=media,categories,menu_options")
-
-                    # Check if menu item belongs to category
-                    if {'type': 'categories', 'id': str(category_id)} in self.menu_items[menu_item_id]['data']['relationships']['categories']['data']:
-                        menu[category_id].append(menu_item_id)
+
+        # Distribute menu items to categories, in menu items list order
+        for menu_item in menu_items_list:
+            menu_item_id = int(menu_item['id'])
+            for category_id in item_categories[menu_item_id]:
+                if category_id in menu:
+                    menu[category_id].append(menu_item_id)
+
+        # Index position of every menu item in its category for item navigation
+        catalog['menu_positions'][location_id] = {}
+        for category_id in menu:
+            catalog['menu_positions'][location_id][category_id] = {menu_item_id: position for position, menu_item_id in enumerate(menu[category_id])}
 
         return menu
 
+    async def load_menu_items_batch(self, location_id: int, menu_items: dict) -> list:
+        '''Load menu items of a location with their relationships from the paged menus list.'''
+        menu_items_list, included = await self.request_pages(f"menus?location={location_id}&include=media,categories,menu_options")
+        self.add_batch_menu_items(menu_items_list, included, menu_items)
+        return menu_items_list
+
+    def add_batch_menu_items(self, menu_items_list: list, included: list, menu_items: dict) -> None:
+        '''Store menu items from a list response to menu_items in the same format as menus/{id} response.
+        Items which relationships are missing in the response are skipped.'''
+        # Index included resources by type and ID
+        included_index = {(resource['type'], str(resource['id'])): resource for resource in included}
+
+        for menu_item in menu_items_list:
+            menu_item_id = int(menu_item['id'])
+            relationships = menu_item.get('relationships', {})
+            if menu_item_id in menu_items or 'categories' not in relationships:
+                continue
+
+            # Collect included resources of this menu item
+            item_included = []
+            complete = True
+            for relation in ['media', 'categories', 'menu_options']:
+                references = relationships.get(relation, {}).get('data') or []
+                # To-one relationships are not wrapped in a list
+                if isinstance(references, dict):
+                    references = [references]
+                for reference in references:
+                    resource = included_index.get((reference['type'], str(reference['id'])))
+                    if resource is None:
+                        complete = False
+                        break
+                    item_included.append(resource)
+
+            if complete:
+                menu_items[menu_item_id] = {'data': menu_item, 'included': item_included}
+
     def print_menus(self):
         # Print active locations titles and menu items
         for location_id in self.locations:
@@ -158,85 +433,87 @@ class TastyIgniter():
         (  /  )
          \(__)|""") # Copilot is a great tool for writing code
 
-    def request(self, uri: str) -> dict:
-        '''Request any API endpoint and return JSON response.'''
-        resp = [] # Response
-
-        # Log request
-        self.logger.debug(f"API ({self.attempts}): {uri}")
-  
-        # Filtrate request
-        if uri.startswith("/"):
-            request = uri[1:]
-        else:
-            request = uri
-        # Check if there is a cached response if caching is enabled
-        if self.config['ti-api-cache']:
-            # Generate filename
-            filename = hashlib.md5(uri.encode()).hexdigest()[:8]
-            if os.path.isfile(f"cache/req_{filename}.json"):
-                with open(f"cache/req_{filename}.json", "r") as f:
-                    return json.load(f)
-
-        # Delay every 30 requests to avoid 429 error
-        self.api_request_counter += 1
-
-        # Create Bearer authorization header
-        headers =  {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.config['ti-token']}"
-        }
-
-        # Request API
-        try:
-            response = requests.get(f"{self.config['ti-url']}/{request}", headers=headers)
-        except Exception as e:
-            self.logger.error(f"Error {response.status_code} while connecting to Tastyigniter API")
-                    
-            # Repeat request if there are less than 5 errors
-            if self.attempts < self.config['ti-api-max-attempts']:
-                self.attempts += 1
-                # handle Error 429:
-                if response.status_code == 429:
-                    self.loggger.info("Waiting 1 second to avoid 429 error")
-                    time.sleep(1)
-                    
-                return self.request(uri)
-            # Exit the program if there are more than 5 errors
-            else:
-                self.logger.error("There are more than 5 errors while connecting to Tastyigniter API")
-                self.logger.info("1. Check API URL and API token in your configuration file")
-                self.logger.info("2. Check if Tastyigniter API is running")
-                self.logger.info("3. Check if Tastyigniter API is accessible from this machine")
-                self.logger.info(f"4. Check if {uri} endpoint is enabled in Tastyigniter API for this token")
-                self.logger.error(f"Error: {e}")
-                exit(1) 
-        else:
-            if response.status_code == 200:
-                # Reset attempts counter
-                self.attempts = 0
-                # Return JSON response
-                resp = response.json()
-
-                # Cache response to file if caching is enabled
-                if self.config['ti-api-cache']:
-                    # Save response to file
-                    # Generate unique filename
-                    filename = hashlib.md5(uri.encode()).hexdigest()[:8]
-                    with open(f"cache/req_{filename}.json", "w") as file:
-                        file.write(json.dumps(resp, indent=4))
-                return resp # Return JSON response
+    async def request(self, uri: str) -> dict:
+        '''Request any API endpoint and return JSON response. Raises APIError if request failed.'''
+        self.logger.debug(f"API: {uri}")
+        request = uri[1:] if uri.startswith("/") else uri
+
+        # Check if there is a cached response if caching is enabled. Disk reads are done in a thread
+        cached = None
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, request)
+            if cached is not None and cached['fresh']:
+                return cached['body']
+
+        url = f"{self.config['ti-url']}/{request}"
+        response = await self.fetch(url, self.request_headers(cached))
+        resp = await asyncio.to_thread(self.process_response, request, response, cached)
+        if resp is None:
+            raise APIError(f"Error {response.status_code} while retrieving {request}")
+        return resp
+
+    async def fetch(self, url: str, headers: dict | None = None) -> httpx.Response:
+        '''GET request with the host rate limit and retries. Returns the first response which is not retried.
+        Raises APIError if all attempts failed.'''
+        client = self.get_client()
+        for attempt in range(self.config['ti-api-max-attempts'] + 1):
+            # Wait for the host rate limit
+            await asyncio.sleep(self.scheduler.reserve(url))
+            try:
+                async with self.semaphore:
+                    response = await client.get(url, headers=headers)
+            except httpx.HTTPError as e:
+                self.logger.error(f"Error while connecting to {url}: {e}")
+                response = None
             else:
-                self.logger.error(f"Error while retrieving {uri}")
-                self.logger.error(f"Error {response.status_code}: {response.text}")
-                exit(1)
+                if not self.scheduler.should_retry(response.status_code):
+                    return response
 
-    def clear_cache(self):
-        '''Clear cache directory.'''
-        for file in os.listdir("cache"):
-            # If filename contains "req_" then it is a cached request
-            if file.startswith("req_"):
-                os.remove(f"cache/{file}")
+            if attempt == self.config['ti-api-max-attempts']:
+                break
+            # Retry after backoff or Retry-After
+            delay = self.scheduler.retry_delay(url, attempt, response)
+            self.logger.info(f"Retrying {url} in {delay:.1f}s ({response.status_code if response is not None else 'connection error'})")
+            await asyncio.sleep(delay)
+
+        self.scheduler.count('failures')
+        raise APIError(f"There are more than {self.config['ti-api-max-attempts']} errors while retrieving {url}")
+
+    async def request_pages(self, uri: str) -> tuple:
+        '''Request all pages of a list endpoint. Returns (data, included) of all pages joined together.'''
+        first_page = await self.request(self.page_uri(uri, 1))
+        pages = [first_page] + await self.request_many([self.page_uri(uri, page) for page in range(2, self.total_pages(first_page) + 1)])
+        return self.join_pages(pages)
+
+    def page_uri(self, uri: str, page: int) -> str:
+        '''URI of a list endpoint page.'''
+        separator = '&' if '?' in uri else '?'
+        return f"{uri}{separator}pageLimit={self.config.get('ti-api-page-size', 100)}&page={page}"
+
+    def total_pages(self, page: dict) -> int:
+        '''Number of pages of a list endpoint.'''
+        return page.get('meta', {}).get('pagination', {}).get('total_pages', 1)
+
+    def join_pages(self, pages: list) -> tuple:
+        '''Join data and included resources of list endpoint pages.'''
+        data = []
+        included = []
+        for page in pages:
+            data += page['data']
+            included += page.get('included', [])
+        return data, included
+
+    async def request_many(self, uris: list) -> list:
+        '''Request several API endpoints concurrently. Returns JSON responses in the same order as uris.'''
+        return list(await asyncio.gather(*[self.request(uri) for uri in uris]))
+
+    def clear_cache(self, *endpoints: str, hard: bool = False) -> None:
+        '''Invalidate cached responses of endpoints ('menus', 'coupons', ...) or all cached responses if no endpoints given.
+        Invalidated responses are revalidated on the next request, hard invalidation removes them.'''
+        if self.cache is None:
+            return
+        for endpoint in endpoints or [None]:
+            self.cache.invalidate(endpoint, hard)
 
     def get_item_options(self, item_id: int) -> list:
         '''Get item options from user cart.'''
@@ -249,114 +526,110 @@ class TastyIgniter():
                     break
         return available_item_options
 
-    def get_location_info(self, location_id: int) -> dict:
-        '''Returns location object'''
-        
-        # find location by id in active_locations
-        for location in self.active_locations:
-            if int(location['id']) == location_id:
-                # update location with parsed location info (TEMP FIX)
-                parsed_location = self.parse_location_info(location)
-                location['options'] = parsed_location['options']
-                location['schedule'] = parsed_location['schedule']
-                return location        
+    async def get_location_info(self, location_id: int) -> dict:
+        '''Returns location object with parsed options and schedule.
+        Parsed info is cached for ti-location-info-ttl seconds, expired info is refreshed in background.'''
+        location = self.find_active_location(location_id)
+        if location is None:
+            return None
+
+        if location_id not in self.location_info:
+            self.store_location_info(location_id, await self.parse_location_info(location))
+        elif self.location_info_expired(location_id) and location_id not in self.location_info_refreshing:
+            self.location_info_refreshing.add(location_id)
+            task = asyncio.create_task(self.refresh_location_info(location))
+            # Keep a reference to the task until it is done
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+
+        # Catalog snapshot is not changed
+        return {**location, 'options': self.location_info[location_id]['options'], 'schedule': self.location_info[location_id]['schedule']}
+
+    def find_active_location(self, location_id: int) -> dict | None:
+        '''Find active location by id.'''
+        return self.catalog.active_by_id.get(location_id)
+
+    def is_active_location(self, location_id: int) -> bool:
+        return location_id in self.catalog.active_by_id
+
+    def get_location_display(self, location_id: int) -> dict:
+        '''Location 'name', 'address' and 'description' prepared for messages.'''
+        return self.catalog.location_display[location_id]
+
+    def store_location_info(self, location_id: int, parsed_location: dict) -> None:
+        '''Cache parsed location info.'''
+        self.location_info[location_id] = {**parsed_location, 'compiled': compile_schedule(parsed_location['schedule']), 'fetched_at': time.monotonic()}
+        self.location_info_refreshing.discard(location_id)
+
+    def location_info_expired(self, location_id: int) -> bool:
+        return time.monotonic() - self.location_info[location_id]['fetched_at'] > self.config.get('ti-location-info-ttl', 600)
+
+    async def refresh_location_info(self, location: dict) -> None:
+        '''Parse location info page again. Cached info is kept if it fails.'''
+        try:
+            self.store_location_info(int(location['id']), await self.parse_location_info(location))
+        except Exception as e:
+            self.logger.warning(f"Can't refresh location {location['id']} info: {e}")
+            self.location_info_refreshing.discard(int(location['id']))
+
+    def get_location_schedule(self, location_id: int) -> dict:
+        '''Compiled location schedule from the latest parsed location info: {order_type: WeeklySchedule}'''
+        if location_id in self.location_info:
+            return self.location_info[location_id]['compiled']
+        location = self.find_active_location(location_id)
+        return compile_schedule(location['schedule']) if location is not None else {}
 
     def get_location_statuses(self, location_id: int) -> dict:
-        # Return location next opening/closing time for 'delivery', 'collection' and 'opening'
-        statuses = {
-            'delivery': {'status': False, 'starts': '', 'ends': ''},
-            'pickup': {'status': False, 'starts': '', 'ends': ''},
-            'opening': {'status': False, 'starts': '', 'ends': ''},
-        }
-        schedule = {}
-        
-        # find location by id in active_locations
-        for location in self.active_locations:
-            if int(location['id']) == location_id:
-                schedule = location['schedule']
-                break
-        
-        # Check if now is in interval for today in schedule
-        current_day = datetime.datetime.now().strftime('%a').lower()
-        for order_type in statuses:
-            current = schedule[order_type][current_day]
-            # replace 00:00 pm with 11:59 pm
-            if current['start'] == '00:00 pm':
-                current['start'] = '11:59 pm'
-            if current['end'] == '00:00 pm':
-                current['end'] = '11:59 pm'
-            
-            statuses[order_type]['status'] = self.is_now_between(current['start'], current['end'])
-            
-            if statuses[order_type]['status']:
-                statuses[order_type]['ends'] = current['end']
+        # Return location next opening/closing time for 'delivery', 'pickup' and 'opening'
+        schedule = self.get_location_schedule(location_id)
+        now = self.now()
+
+        statuses = {}
+        for order_type in ['delivery', 'pickup', 'opening']:
+            if order_type in schedule:
+                statuses[order_type] = schedule[order_type].status(now)
             else:
-                # Find next opening time in schedule
-                if self.is_now_before(current['start']):
-                    statuses[order_type]['starts'] = current['start']
-                else:
-                    for day in schedule[order_type]:
-                        if schedule[order_type][day]['start'] != '00:00 pm':
-                            statuses[order_type]['starts'] = schedule[order_type][day]['start'] + " on " + datetime.datetime.strptime(day, '%a').strftime('%A')
-                            break
-        
+                statuses[order_type] = {'status': False, 'starts': '', 'ends': ''}
         return statuses
-    
-    def is_now_between(self, start_time, end_time) -> bool:
-        timezone_offset = self.config['ti-timezone-offset']
-        # Get current time
-        now = datetime.datetime.utcnow() + datetime.timedelta(hours=timezone_offset)
-        date = datetime.datetime.now().strftime('%Y-%m-%d')
-
-        if start_time == '00:00 pm':
-            start_time = '12:00 am'
-        if end_time == '00:00 pm':
-            end_time = '12:00 am'
-
-        # Convert start and end times to datetime objects
-        start_time = datetime.datetime.strptime(date + ' ' + start_time, "%Y-%m-%d %I:%M %p")
-        end_time = datetime.datetime.strptime(date + ' ' + end_time, "%Y-%m-%d %I:%M %p")
-        now = datetime.datetime.strptime(date + ' ' + now.strftime("%I:%M %p"), "%Y-%m-%d %I:%M %p")
-
-        # Check if current time is between start and end times
-        if start_time <= now <= end_time:
-            return True
-        else:
-            return False
-    
-    def is_now_before(self, start_time) -> bool:
-        timezone_offset = self.config['ti-timezone-offset']
-        # Get current time
-        now = datetime.datetime.utcnow() + datetime.timedelta(hours=timezone_offset)
-        date = datetime.datetime.now().strftime('%Y-%m-%d')
-
-        # Convert start and end times to datetime objects
-        start_time = datetime.datetime.strptime(date + ' ' + start_time, "%Y-%m-%d %I:%M %p")
-        now = datetime.datetime.strptime(date + ' ' + now.strftime("%I:%M %p"), "%Y-%m-%d %I:%M %p")
-
-        # Check if current time is before start time
-        if now < start_time:
-            return True
-        else:
-            return False
+
+    def now(self) -> datetime.datetime:
+        '''Current time in the restaurant timezone.'''
+        return datetime.datetime.utcnow() + datetime.timedelta(hours=self.config['ti-timezone-offset'])
     
     def get_location_address(self, location_id: int) -> str:
-        # Return location address: location_address_1 + location_address_2 + location_city
-        return f"{self.active_locations[location_id]['attributes']['location_address_1']} {self.active_locations[location_id]['attributes']['location_address_2']} {self.active_locations[location_id]['attributes']['location_city']}"
+        # Return location address: location_address_1, location_address_2, location_city
+        return self.catalog.location_display[location_id]['address']
 
     def get_location_name(self, location_id: int) -> str:
-        return self.active_locations[location_id]['attributes']['location_name']
-
-    def get_coupon(self, coupon_code: str) -> dict:
-        '''Check if coupon code is valid.'''
-        # Find coupon by code in coupons dictionary
-        for coupon in self.coupons:
-            if coupon['attributes']['code'] == coupon_code:
-                return coupon
-        return None
-
-    def parse_location_info(self, location: dict) -> dict:
-        '''Temporary function to get location options via parsing 🤦‍♂️ location info page.'''    
+        return self.catalog.location_display[location_id]['name']
+
+    def get_coupon(self, coupon_code: str) -> dict | None:
+        '''Check if coupon code is valid. Codes are compared without case and surrounding spaces.'''
+        return self.catalog.get_coupon(coupon_code)
+
+    def applicable_coupons(self, location_id: int, menu_item_ids) -> list:
+        '''Coupons which can be used in location for an order of menu items.'''
+        return self.catalog.applicable_coupons(location_id, menu_item_ids)
+
+    async def parse_location_info(self, location: dict) -> dict:
+        '''Temporary function to get location options via parsing 🤦‍♂️ location info page.'''
+        # Connection errors and retryable statuses are retried like API requests
+        url = self.location_info_url(location)
+        response = await self.fetch(url)
+
+        if response.status_code != 200:
+            raise APIError(f"Error {response.status_code} while retrieving {url}")
+
+        # Parsing takes a while on big pages, keep it out of the event loop
+        return await asyncio.to_thread(self.parse_location_page, response.content)
+
+    def location_info_url(self, location: dict) -> str:
+        '''URL of location info page.'''
+        url = self.config['ti-url'].replace('/api', '')
+        return f"{url}/{location['attributes']['permalink_slug']}/info"
+
+    def parse_location_page(self, page: bytes) -> dict:
+        '''Parse location options and schedule from location info page.'''
     
         # Structure of the options dictionary from the documentation of the API
         options = {
@@ -377,10 +650,6 @@ class TastyIgniter():
             'delivery': {},
             'pickup': {}
         }
-        
-        # Generate URL to location info page
-        url = self.config['ti-url'].replace('/api', '')
-        url = f"{url}/{location['attributes']['permalink_slug']}/info"
 
         # Fill schedule with empty strings for each day of the week (Mon-Sun)
         for day in ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']:
@@ -388,15 +657,8 @@ class TastyIgniter():
             schedule['delivery'][day] = None
             schedule['pickup'][day] = None
 
-        # Make a GET request to the URL and store the response
-        response = requests.get(url)
-
-        if response.status_code != 200:
-            print('Error: response.status_code =', response.status_code)
-            exit()
-
         # Create a BeautifulSoup object from the response content
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = BeautifulSoup(page, HTML_PARSER)
 
         # Find content div
         content = soup.find('div', {'class': 'content'})
@@ -466,17 +728,13 @@ class TastyIgniter():
         if 'Delivery is not available.' in content.text:
             options['offer_delivery'] = False
         else:
-            # Current item in schedule
-            current = schedule['delivery'][datetime.datetime.now().strftime('%a').lower()]
-            options['offer_delivery'] = self.is_now_between(current['start'], current['end'])
+            options['offer_delivery'] = WeeklySchedule(schedule['delivery']).is_open(self.now())
 
         # Check if Pick-up is disabled
         if 'Pick-up is not available.' in content.text:
             options['offer_collection'] = False
         else:
-            # Current item in schedule
-            current = schedule['pickup'][datetime.datetime.now().strftime('%a').lower()]
-            options['offer_collection'] = self.is_now_between(current['start'], current['end'])
+            options['offer_collection'] = WeeklySchedule(schedule['pickup']).is_open(self.now())
 
         return {'options': options, 'schedule': schedule}
     
@@ -512,5 +770,3 @@ class TastyIgniter():
 
     def place_order() -> bool:
         "Placing order via API and "
-        
-        
\ No newline at end of file
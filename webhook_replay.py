@@ -0,0 +1,108 @@
+'''Local stand-in for Telegram: posts recorded updates to the bot's webhook listener.
+Run the bot with "tg-mode: webhook", then:
+    python3 webhook_replay.py replay updates.json [url] [concurrent users]
+updates.json is a list of updates, one update per line, or getUpdates response saved with
+    curl https://api.telegram.org/bot<token>/getUpdates > updates.json
+Synthetic updates of several users can be generated with:
+    python3 webhook_replay.py sample [users] [updates per user] > updates.json'''
+
+import json, sys, time
+import urllib.error, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from classes import Config
+
+
+def load_updates(filename: str) -> list:
+    '''Updates from a json list, json lines or getUpdates response.'''
+    with open(filename, 'r') as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        return data['result'] if 'result' in data else [data]
+    return data
+
+
+def user_id(update: dict) -> int | None:
+    '''ID of the user who sent the update.'''
+    for kind in ('message', 'edited_message', 'callback_query'):
+        if kind in update:
+            return update[kind]['from']['id']
+    return None
+
+
+def sample_updates(users: int = 10, per_user: int = 5) -> list:
+    '''/start command followed by location button presses for every user.'''
+    updates = []
+    now = int(time.time())
+    for n in range(per_user):
+        for uid in range(1, users + 1):
+            user = {'id': uid, 'is_bot': False, 'first_name': f"User {uid}"}
+            chat = {'id': uid, 'type': 'private'}
+            update_id = len(updates) + 1
+            if n == 0:
+                updates.append({'update_id': update_id, 'message': {
+                    'message_id': update_id, 'date': now, 'chat': chat, 'from': user,
+                    'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+                }})
+            else:
+                updates.append({'update_id': update_id, 'callback_query': {
+                    'id': str(update_id), 'from': user, 'chat_instance': str(uid), 'data': 'location-1',
+                    'message': {'message_id': update_id - users, 'date': now, 'chat': chat, 'text': 'Menu'},
+                }})
+    return updates
+
+
+def replay(updates: list, url: str, secret: str | None, concurrency: int = 8) -> None:
+    '''Post updates to the webhook. Updates of one user are posted in order, users are posted concurrently.'''
+    by_user = {}
+    for update in updates:
+        by_user.setdefault(user_id(update), []).append(update)
+
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+    latencies = []
+    statuses = {}
+
+    def post_all(user_updates: list) -> None:
+        for update in user_updates:
+            request = urllib.request.Request(url, data=json.dumps(update).encode(), headers=headers, method='POST')
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code # Wrong secret token is 403
+            except OSError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(post_all, by_user.values()))
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Posted {len(latencies)} updates of {len(by_user)} users in {seconds:.2f} s ({len(latencies) / seconds:.1f} updates/s)")
+    if latencies:
+        print(f"Latency ms: p50 {latencies[len(latencies) // 2] * 1000:.1f}, p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}, max {latencies[-1] * 1000:.1f}")
+    print(f"Responses: {statuses}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "sample":
+        print(json.dumps(sample_updates(*[int(arg) for arg in sys.argv[2:4]]), indent=1))
+    elif len(sys.argv) >= 3 and sys.argv[1] == "replay":
+        config = Config.shared()
+        url = sys.argv[3] if len(sys.argv) > 3 else f"http://{config.get('tg-webhook-listen', '127.0.0.1')}:{config.get('tg-webhook-port', 8443)}/{config.get('tg-webhook-path', 'telegram')}"
+        concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+        replay(load_updates(sys.argv[2]), url, config.get('tg-webhook-secret') or None, concurrency)
+    else:
+        print("Usage: python3 webhook_replay.py replay updates.json [url] [concurrent users]")
+        print("       python3 webhook_replay.py sample [users] [updates per user] > updates.json")
+        exit(1)